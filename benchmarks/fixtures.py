@@ -0,0 +1,160 @@
+import os
+import random
+import sys
+import types
+import chess
+import chess.pgn
+import cv2
+import numpy as np
+from routes.fen_generator import FEN_MAPPING
+
+
+BACKGROUND = 90
+LIGHT_SQUARE = (210, 210, 210)
+DARK_SQUARE = (120, 120, 120)
+# BGR colour of every piece class, white pieces bright and black pieces at half intensity
+HUES = {
+    chess.PAWN: (0, 0, 1), chess.KNIGHT: (0, 1, 0), chess.BISHOP: (1, 0, 0),
+    chess.ROOK: (0, 1, 1), chess.QUEEN: (1, 0, 1), chess.KING: (1, 1, 0),
+}
+CLASS_NAMES = list(FEN_MAPPING)
+PIECE_COLOURS = {
+    name: tuple(v * (255 if FEN_MAPPING[name].isupper() else 128) for v in HUES[chess.Piece.from_symbol(FEN_MAPPING[name]).piece_type])
+    for name in CLASS_NAMES
+}
+
+OPENING_LINES = [
+    "e4 e5 Nf3 Nc6 Bb5 a6",
+    "d4 d5 c4 e6 Nc3 Nf6",
+    "e4 c5 Nf3 d6 d4 cxd4",
+    "c4 e5 Nc3 Nf6 g3 d5",
+    "e4 e6 d4 d5 Nc3 Bb4",
+    "d4 Nf6 c4 g6 Nc3 Bg7",
+]
+
+
+def random_position(rng: random.Random, plies: int) -> chess.Board:
+    board = chess.Board()
+    for _ in range(plies):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        board.push(rng.choice(moves))
+    return board
+
+
+def board_image(board: chess.Board, rng: random.Random, width: int = 1600, height: int = 1200) -> bytes:
+    # JPEG of a camera-sized frame with the board somewhere in it, the same layout for every perspective "w" request
+    frame = np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+    frame += np.random.default_rng(rng.randrange(2 ** 32)).integers(0, 4, frame.shape, dtype=np.uint8)
+    size = rng.randrange(min(width, height) // 2, min(width, height) - 40) // 8 * 8
+    x0, y0 = rng.randrange(0, width - size), rng.randrange(0, height - size)
+    square = size // 8
+    for row in range(8):
+        for col in range(8):
+            colour = LIGHT_SQUARE if (row + col) % 2 == 0 else DARK_SQUARE
+            frame[y0 + row * square:y0 + (row + 1) * square, x0 + col * square:x0 + (col + 1) * square] = colour
+            piece = board.piece_at(chess.square(col, 7 - row))
+            if piece is not None:
+                name = next(n for n in CLASS_NAMES if FEN_MAPPING[n] == piece.symbol())
+                center = (x0 + col * square + square // 2, y0 + row * square + square // 2)
+                cv2.circle(frame, center, square * 3 // 8, PIECE_COLOURS[name], -1)
+    _, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def synthetic_boards(count: int, seed: int = 0):
+    # [(jpeg bytes, expected FEN for perspective w and white to move)]
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(count):
+        board = random_position(rng, rng.randrange(0, 60))
+        boards.append((board_image(board, rng), f"{board.board_fen()} w - - 0 0"))
+    return boards
+
+
+def pgn_corpus(count: int, seed: int = 0, min_plies: int = 30, max_plies: int = 120):
+    # PGN strings of random games starting from common openings
+    rng = random.Random(seed)
+    games = []
+    for index in range(count):
+        board = chess.Board()
+        for san in OPENING_LINES[index % len(OPENING_LINES)].split():
+            board.push_san(san)
+        for _ in range(rng.randrange(min_plies, max_plies)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            captures = [move for move in moves if board.is_capture(move)]
+            board.push(rng.choice(captures) if captures and rng.random() < 0.5 else rng.choice(moves))
+        game = chess.pgn.Game.from_board(board)
+        game.headers["Event"] = "Benchmark"
+        game.headers["White"] = f"White {index}"
+        game.headers["Black"] = f"Black {index}"
+        game.headers["Result"] = board.result(claim_draw=True)
+        games.append(str(game) + "\n")
+    return games
+
+
+class _Boxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32)
+        self.cls = np.asarray(cls, dtype=np.float32)
+
+
+class _Result:
+    def __init__(self, boxes: _Boxes):
+        self.boxes = boxes
+
+
+class StubYOLO:
+    """Stands in for ultralytics.YOLO on the synthetic boards, no weights or torch needed.
+
+    The segmentation stub boxes everything that is not background, the detection
+    stub reads the piece colour at every square center of the 224x224 board.
+    """
+
+    palette = np.array([LIGHT_SQUARE, DARK_SQUARE] + [PIECE_COLOURS[name] for name in CLASS_NAMES], dtype=np.float32)
+
+    def __init__(self, path, task=None, **kwargs):
+        self.path = path
+        self.task = task or ("segment" if "seg" in os.path.basename(str(path)).lower() else "detect")
+        self.names = dict(enumerate(CLASS_NAMES))
+
+    def predict(self, images, **kwargs):
+        images = images if isinstance(images, list) else [images]
+        return [self._segment(image) if self.task == "segment" else self._detect(image) for image in images]
+
+    def _segment(self, image: np.ndarray) -> _Result:
+        # every 4th pixel is enough to find the board edges to within a few pixels
+        step = 4
+        mask = np.abs(image[::step, ::step].astype(np.int16) - BACKGROUND).max(axis=2) > 25
+        rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+        if not len(rows):
+            return _Result(_Boxes([], [], []))
+        return _Result(_Boxes([[cols[0] * step, rows[0] * step, (cols[-1] + 1) * step, (rows[-1] + 1) * step]], [0.95], [0]))
+
+    def _detect(self, image: np.ndarray) -> _Result:
+        square = image.shape[0] // 8
+        centers = image[square // 2::square, square // 2::square][:8, :8].astype(np.float32)
+        distance = np.linalg.norm(centers[:, :, None, :] - self.palette[None, None], axis=3)
+        nearest = distance.argmin(axis=2) - 2
+        rows, cols = np.nonzero(nearest >= 0)
+        boxes = [[col * square + 2, row * square + 2, (col + 1) * square - 2, (row + 1) * square - 2] for row, col in zip(rows, cols)]
+        return _Result(_Boxes(boxes, [0.9] * len(boxes), nearest[rows, cols]))
+
+
+def install_stub_models():
+    # Must run before the first model is loaded, LazyModel imports ultralytics on first use
+    module = types.ModuleType("ultralytics")
+    module.YOLO = StubYOLO
+    sys.modules["ultralytics"] = module
+
+
+def stub_engine_command(latency_ms: float):
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_engine.py"), "--latency-ms", str(latency_ms)]
+
+
+def stub_groq_command(port: int, latency_ms: float):
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_groq.py"), "--port", str(port), "--latency-ms", str(latency_ms)]
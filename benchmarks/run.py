@@ -0,0 +1,243 @@
+"""Latency and throughput of every stage of the FEN and review pipelines.
+
+Runs offline: boards are synthetic JPEGs, games a generated PGN corpus and the
+engine is benchmarks/stub_engine.py unless --engine stockfish is given. The
+text review is a fixed delay, or with --groq-stub goes through the real client
+to benchmarks/stub_groq.py. With --models stub (the default) the YOLO models
+are replaced by StubYOLO, so neither torch nor the weights are needed;
+--models real measures the actual models on CPU. Run from the repository root:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json --tolerance 0.25
+
+With --baseline the exit status is 1 when any stage got slower than the
+baseline by more than the tolerance, at p95 latency or throughput.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.fixtures import synthetic_boards, pgn_corpus, install_stub_models, stub_engine_command, stub_groq_command
+
+
+def summarize(latencies, wall_time):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / wall_time if wall_time else 0.0,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+async def measure(call, inputs, concurrency=1, warmup=1):
+    # Runs call(item) for every input with at most `concurrency` in flight, the first `warmup` calls are not counted
+    for item in inputs[:warmup]:
+        await call(item)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(item):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(item)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(item) for item in inputs))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def sync(func):
+    async def call(item):
+        return func(item)
+    return call
+
+
+async def run_benchmarks(args):
+    from routes.image_pipeline import decode_image, resize_into, BOARD_SIZE
+    from routes.segmentation import segment_chess_board, seg_model
+    from routes.detection import detect_pieces, detect_model
+    from routes.fen_generator import gen_fen, gen_fen_batch
+    from routes.opening_book import OpeningBook, load_opening_book
+    from routes.engine_pool import engine_pool
+    import routes.chess_review as chess_review
+    from routes.tex_based_review import close_client
+    import main
+    import httpx
+
+    if args.engine == "stub":
+        engine_pool.path = stub_engine_command(args.engine_latency_ms)
+
+    if not args.groq_stub:
+        # The text review is an external API call, it is replaced by a fixed delay
+        async def stub_text_review(pgn_content):
+            await asyncio.sleep(args.text_review_ms / 1000)
+            return {"summary": "benchmark"}
+        chess_review.text_review = stub_text_review
+
+    print(f"Generating {args.images} boards and {args.games} games", file=sys.stderr)
+    boards = synthetic_boards(args.images, seed=args.seed)
+    games = pgn_corpus(args.games, seed=args.seed)
+    results = {}
+
+    def report(name, stats):
+        results[name] = stats
+        print(f"{name:<28} n={stats['count']:<5} {stats['throughput']:>9.1f}/s  p50 {stats['p50_ms']:>9.2f}ms  p95 {stats['p95_ms']:>9.2f}ms  p99 {stats['p99_ms']:>9.2f}ms", file=sys.stderr)
+
+    # FEN pipeline, stage by stage
+    frames = [decode_image(image) for image, _ in boards]
+    report("decode_image", await measure(sync(decode_image), [image for image, _ in boards], warmup=args.warmup))
+    report("segment_chess_board", await measure(segment_chess_board, frames, warmup=args.warmup))
+    crops = [await segment_chess_board(frame) for frame in frames]
+    resized = [resize_into(crop, np.empty((BOARD_SIZE, BOARD_SIZE, 3), dtype=np.uint8)) for crop in crops]
+    report("detect_pieces", await measure(detect_pieces, resized, warmup=args.warmup))
+    detections = [await detect_pieces(board) for board in resized]
+    report("gen_fen", await measure(sync(lambda result: gen_fen(result, "w", "w")), detections, warmup=args.warmup))
+    batches = [detections[i:i + 8] for i in range(0, len(detections), 8)]
+    report("gen_fen_batch_8", await measure(sync(lambda batch: gen_fen_batch(batch, "w", "w")), batches, warmup=0))
+    accuracy = sum(gen_fen(result, "w", "w") == expected for result, (_, expected) in zip(detections, boards)) / len(boards)
+
+    # Opening book, compiled from the CSV and loaded from the mmap'd index
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = os.path.join(directory, "openings.bin")
+        csv_path = chess_review.book_csv_path
+        report("opening_book_compile", await measure(sync(lambda _: OpeningBook.compile(csv_path).save(index_path)), [None] * args.book_runs, warmup=0))
+        report("load_opening_book", await measure(sync(lambda _: load_opening_book(csv_path, index_path)), [None] * args.book_runs * 10, warmup=1))
+
+    # Review, one game at a time and through the endpoints
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index, pgn in enumerate(games):
+            paths.append(os.path.join(directory, f"game{index}.pgn"))
+            with open(paths[-1], "w") as pgn_file:
+                pgn_file.write(pgn)
+        report("analyze_pgn", await measure(lambda path: chess_review.analyze_pgn(path, args.profile), paths, warmup=args.warmup))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark", timeout=None) as client:
+        async def get_fen(image):
+            response = await client.post("/getFen", files={"file": ("board.jpg", image, "image/jpeg")})
+            response.raise_for_status()
+
+        async def get_review(pgn):
+            response = await client.post("/getReview", json={"file_data": base64.b64encode(pgn.encode()).decode(), "profile": args.profile})
+            response.raise_for_status()
+
+        async def get_review_raw(pgn):
+            response = await client.post("/getReview", params={"profile": args.profile}, content=pgn.encode(), headers={"content-type": "text/plain"})
+            response.raise_for_status()
+
+        report("endpoint_getFen", await measure(get_fen, [image for image, _ in boards], args.concurrency, warmup=args.warmup))
+        report("endpoint_getReview", await measure(get_review, games, args.concurrency, warmup=args.warmup))
+        report("endpoint_getReview_raw", await measure(get_review_raw, games, args.concurrency, warmup=args.warmup))
+
+    await engine_pool.close()
+    await close_client()
+    return results, {"fen_accuracy": accuracy, "models": {"segmentation": seg_model.status(), "detection": detect_model.status()}}
+
+
+def compare(results, baseline, tolerance):
+    # Stages slower than the baseline by more than the tolerance, at p95 latency or throughput
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline.get("stages", {}).get(name)
+        if reference is None:
+            continue
+        p95_ratio = stats["p95_ms"] / reference["p95_ms"] if reference["p95_ms"] else 1.0
+        throughput_ratio = stats["throughput"] / reference["throughput"] if reference["throughput"] else 1.0
+        regressed = p95_ratio > 1 + tolerance or throughput_ratio < 1 - tolerance
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {name:<28} p95 x{p95_ratio:.2f}  throughput x{throughput_ratio:.2f}", file=sys.stderr)
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=32, help="number of synthetic boards")
+    parser.add_argument("--games", type=int, default=12, help="number of generated games")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", default="fast", help="analysis profile used for reviews")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight for the endpoint stages")
+    parser.add_argument("--warmup", type=int, default=1, help="calls per stage that are not measured")
+    parser.add_argument("--book-runs", type=int, default=3)
+    parser.add_argument("--models", choices=("stub", "real"), default="stub")
+    parser.add_argument("--engine", choices=("stub", "stockfish"), default="stub", help="stockfish uses STOCKFISH_PATH")
+    parser.add_argument("--engine-latency-ms", type=float, default=2.0, help="time every stub engine search takes")
+    parser.add_argument("--text-review-ms", type=float, default=0.0, help="delay standing in for the text review API")
+    parser.add_argument("--groq-stub", action="store_true", help="send text reviews through the real client to benchmarks/stub_groq.py")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    # Caches would turn repeated positions and uploads into lookups, every run measures the full work
+    os.environ.setdefault("EVAL_CACHE_PATH", "")
+    os.environ.setdefault("EVAL_CACHE_MEMORY_SIZE", "0")
+    os.environ.setdefault("FEN_CACHE_MODE", "off")
+    os.environ.setdefault("REVIEW_CACHE_PATH", "")
+    os.environ.setdefault("ENGINE_PRESTART", "0")
+    if args.models == "stub":
+        install_stub_models()
+    groq_stub = None
+    if args.groq_stub:
+        port = free_port()
+        groq_stub = subprocess.Popen(stub_groq_command(port, args.text_review_ms), stdout=subprocess.PIPE)
+        groq_stub.stdout.readline()
+        os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{port}"
+        os.environ["GROQ_API_KEY"] = "stub"
+
+    try:
+        stages, checks = asyncio.run(run_benchmarks(args))
+    finally:
+        if groq_stub is not None:
+            groq_stub.terminate()
+    output = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "options": vars(args),
+        "checks": checks,
+        "stages": stages,
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(stages, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
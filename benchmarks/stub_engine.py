@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Minimal UCI engine for benchmarks, answers every search after a fixed delay.
+
+Evaluations are material plus mobility and the principal variation is the first
+legal moves in UCI order, so results are deterministic but cost no real search.
+
+    python benchmarks/stub_engine.py --latency-ms 5
+"""
+import argparse
+import sys
+import time
+import chess
+
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+
+def evaluate(board: chess.Board) -> int:
+    material = sum(PIECE_VALUES[piece.piece_type] * (1 if piece.color == board.turn else -1) for piece in board.piece_map().values())
+    return material + board.legal_moves.count()
+
+
+def first_move(board: chess.Board):
+    return min(board.legal_moves, key=lambda move: move.uci(), default=None)
+
+
+def search(board: chess.Board, tokens, latency: float):
+    time.sleep(latency)
+    depth = int(tokens[tokens.index("depth") + 1]) if "depth" in tokens else 12
+    move = first_move(board)
+    if move is None:
+        score = "mate 0" if board.is_checkmate() else "cp 0"
+        print(f"info depth 0 score {score}")
+        print("bestmove (none)")
+        return
+
+    pv = [move]
+    board.push(move)
+    reply = first_move(board)
+    board.pop()
+    if reply is not None:
+        pv.append(reply)
+    nodes = 1000 * depth
+    print(f"info depth {depth} seldepth {depth} multipv 1 score cp {evaluate(board)} nodes {nodes} nps {int(nodes / max(latency, 0.001))} time {int(latency * 1000)} pv {' '.join(m.uci() for m in pv)}")
+    print(f"bestmove {move.uci()}")
+
+
+def set_position(tokens) -> chess.Board:
+    moves_at = tokens.index("moves") if "moves" in tokens else len(tokens)
+    board = chess.Board() if tokens[1] == "startpos" else chess.Board(" ".join(tokens[2:moves_at]))
+    for move in tokens[moves_at + 1:]:
+        board.push_uci(move)
+    return board
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="time every search takes")
+    args = parser.parse_args()
+
+    board = chess.Board()
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == "uci":
+            print("id name BenchmarkStub")
+            print("option name Threads type spin default 1 min 1 max 512")
+            print("option name Hash type spin default 16 min 1 max 33554432")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("uciok")
+        elif command == "isready":
+            print("readyok")
+        elif command == "position":
+            board = set_position(tokens)
+        elif command == "go":
+            search(board, tokens, args.latency_ms / 1000)
+        elif command == "quit":
+            break
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
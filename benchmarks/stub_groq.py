@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Local stand-in for the Groq chat completions API.
+
+Streams a fixed JSON review back as server-sent events after a configurable
+delay, so the text review can be tested and benchmarked without network access:
+
+    python benchmarks/stub_groq.py --port 8765 --latency-ms 800
+    GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=stub uvicorn main:app
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+REVIEW = {
+    "summary": "Stub review",
+    "move_reviews": [{"move": "e4", "evaluation": "Good", "commentary": "Solid central control"}],
+    "biggest_blunders": {"player1": "None", "player2": "None"},
+    "recommendations": {"player1": "Keep playing", "player2": "Keep playing"},
+}
+
+
+def chunk(content=None, finish_reason=None):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{"index": 0, "delta": {"content": content} if content else {}, "finish_reason": finish_reason}],
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    chunks = 8
+
+    def do_POST(self):
+        # the review is always streamed, the way routes.tex_based_review asks for it
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/openai/v1/chat/completions":
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        text = "Here is the review:\n```json\n" + json.dumps(REVIEW) + "\n```"
+        pieces = [text[len(text) * i // self.chunks:len(text) * (i + 1) // self.chunks] for i in range(self.chunks)]
+        events = [chunk(piece) for piece in pieces] + [chunk(finish_reason="stop")]
+        try:
+            for event in events:
+                # the delay is spread over the stream like tokens arriving from a model
+                time.sleep(self.latency / len(events))
+                self._write(f"data: {json.dumps(event)}\n\n")
+            self._write("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up, as it does when its timeout expires
+            self.close_connection = True
+
+    def _write(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="time the whole response takes")
+    args = parser.parse_args()
+
+    Handler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Stub Groq API on http://{args.host}:{server.server_port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Offline review of whole PGN databases, one row per move.
+
+Games are streamed from the PGN files and spread over a pool of worker
+processes, each with a single engine, so throughput grows with the number of
+cores. Only file offsets travel between processes and at most a few games per
+worker are in flight, memory stays flat however large the input is. Every
+review goes through routes.chess_review, without the text review, so the
+evaluation and review caches are warmed as a side effect.
+
+    python bulk_analyze.py games/*.pgn --output moves.jsonl --workers 8
+    python bulk_analyze.py big.pgn --output moves.parquet --profile fast
+
+Progress is checkpointed next to the output every --flush-games games. Running
+the same command again resumes where it stopped, games already written are
+skipped and a partly written chunk is discarded. Parquet output is a directory
+of part files and needs pyarrow.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import time
+import chess.pgn
+
+
+COLUMNS = [
+    "file", "offset", "game", "event", "date", "white", "black", "result",
+    "move_number", "player", "phase", "user_move", "evaluation", "evaluation_loss", "classification",
+    "best_move_pre", "follow_up_pre", "best_move_post", "follow_up_post",
+]
+
+
+def scan_games(paths):
+    # (path, byte offset, index in file) of every game, without parsing the moves
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as pgn:
+            index = 0
+            while True:
+                offset = pgn.tell()
+                if not chess.pgn.skip_game(pgn):
+                    break
+                yield path, offset, index
+                index += 1
+
+
+# The event loop every review of a worker process runs on
+_loop = None
+
+
+def init_worker():
+    global _loop
+    from routes.engine_pool import engine_pool
+
+    _loop = asyncio.new_event_loop()
+    # Worker processes exit through multiprocessing, which runs these finalizers but not atexit
+    multiprocessing.util.Finalize(None, lambda: _loop.run_until_complete(engine_pool.close()), exitpriority=10)
+
+
+def analyze_game(path, offset, index, profile):
+    from routes.chess_review import collect_review, game_positions, opening_book
+    from routes.classifier import game_phases
+    from routes.opening_book import is_book_move
+
+    with open(path, encoding="utf-8", errors="replace") as pgn:
+        pgn.seek(offset)
+        game = chess.pgn.read_game(pgn)
+    if game is None:
+        return {"file": path, "offset": offset, "rows": [], "error": "No game found"}
+    try:
+        review = _loop.run_until_complete(collect_review(game, None, profile, parallelism=1))
+    except Exception as e:
+        return {"file": path, "offset": offset, "rows": [], "error": str(e)}
+
+    # The review only counts moves per phase, the phase of every move is worked out again
+    positions = game_positions(game)
+    phases = game_phases(positions, [is_book_move(board, opening_book) for board in positions[1:]])
+    headers = game.headers
+    game_columns = {
+        "file": path, "offset": offset, "game": index,
+        "event": headers.get("Event"), "date": headers.get("Date"),
+        "white": headers.get("White"), "black": headers.get("Black"), "result": headers.get("Result"),
+    }
+    rows = [{**game_columns, "phase": phase, **move} for move, phase in zip(review["move_analysis"], phases)]
+    return {"file": path, "offset": offset, "rows": rows, "error": None}
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def position(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def restore(self, position):
+        # Drops rows written after the last checkpoint
+        if os.path.exists(self.path):
+            with open(self.path, "r+b") as output:
+                output.truncate(position)
+
+    def write(self, rows):
+        with open(self.path, "a") as output:
+            for row in rows:
+                output.write(json.dumps({column: row.get(column) for column in COLUMNS}) + "\n")
+            output.flush()
+            os.fsync(output.fileno())
+        return self.position()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow, pip install pyarrow or write JSONL instead")
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.schema = pyarrow.schema([
+            ("file", pyarrow.string()), ("offset", pyarrow.int64()), ("game", pyarrow.int64()),
+            ("event", pyarrow.string()), ("date", pyarrow.string()), ("white", pyarrow.string()),
+            ("black", pyarrow.string()), ("result", pyarrow.string()),
+            ("move_number", pyarrow.int32()), ("player", pyarrow.string()), ("phase", pyarrow.string()),
+            ("user_move", pyarrow.string()), ("evaluation", pyarrow.float64()), ("evaluation_loss", pyarrow.float64()),
+            ("classification", pyarrow.string()),
+            ("best_move_pre", pyarrow.string()), ("follow_up_pre", pyarrow.list_(pyarrow.string())),
+            ("best_move_post", pyarrow.string()), ("follow_up_post", pyarrow.list_(pyarrow.string())),
+        ])
+
+    def parts(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".parquet"))
+
+    def position(self):
+        return len(self.parts())
+
+    def restore(self, position):
+        for name in self.parts()[position:]:
+            os.remove(os.path.join(self.path, name))
+
+    def write(self, rows):
+        table = self.pa.Table.from_pylist([{column: row.get(column) for column in COLUMNS} for row in rows], schema=self.schema)
+        name = f"part-{self.position():06d}.parquet"
+        self.pq.write_table(table, os.path.join(self.path, name + ".tmp"))
+        os.replace(os.path.join(self.path, name + ".tmp"), os.path.join(self.path, name))
+        return self.position()
+
+
+class Checkpoint:
+    """Games whose rows are in the output, appended as one JSON line per flushed chunk.
+
+    The first line holds the options of the run, every later line the games of
+    one chunk and the output position after it, so a resumed run can cut the
+    output back to the last chunk that was recorded.
+    """
+
+    def __init__(self, path, options):
+        self.path = path
+        self.done = set()
+        self.position = 0
+        self.resumed = os.path.exists(path)
+        if self.resumed:
+            with open(path) as checkpoint:
+                lines = [json.loads(line) for line in checkpoint if line.strip()]
+            if lines[0] != options:
+                sys.exit(f"{path} was written with other options {lines[0]}, remove it to start over")
+            for line in lines[1:]:
+                self.done.update((game_path, offset) for game_path, offset in line["games"])
+                self.position = line["position"]
+        else:
+            with open(path, "w") as checkpoint:
+                checkpoint.write(json.dumps(options) + "\n")
+
+    def record(self, games, position):
+        with open(self.path, "a") as checkpoint:
+            checkpoint.write(json.dumps({"games": games, "position": position}) + "\n")
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        self.done.update((game_path, offset) for game_path, offset in games)
+        self.position = position
+
+
+def run(args):
+    # Workers are spawned, not forked, so they open their own cache connections, and take these settings
+    os.environ["ENGINE_POOL_SIZE"] = "1"
+    os.environ["ENGINE_THREADS"] = str(args.engine_threads)
+    os.environ["ENGINE_PRESTART"] = "0"
+    if args.no_eval_cache:
+        os.environ["EVAL_CACHE_PATH"] = ""
+    from routes.chess_review import ANALYSIS_PROFILES
+    if args.profile not in ANALYSIS_PROFILES:
+        sys.exit(f"profile should be one of {', '.join(ANALYSIS_PROFILES)}")
+
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    writer = ParquetWriter(args.output) if output_format == "parquet" else JsonlWriter(args.output)
+    checkpoint_path = args.checkpoint or args.output.rstrip("/") + ".checkpoint"
+    if not os.path.exists(checkpoint_path) and writer.position():
+        sys.exit(f"{args.output} already has results but there is no {checkpoint_path} to resume from")
+    checkpoint = Checkpoint(checkpoint_path, {
+        "inputs": [os.path.abspath(path) for path in args.inputs], "profile": args.profile, "format": output_format,
+    })
+    writer.restore(checkpoint.position)
+    if checkpoint.done:
+        print(f"Resuming, {len(checkpoint.done)} games already analysed", file=sys.stderr)
+
+    workers = args.workers or os.cpu_count() or 1
+    pending_rows, pending_games = [], []
+    analysed = errors = moves = 0
+    started = time.perf_counter()
+
+    def flush():
+        nonlocal pending_rows, pending_games
+        if pending_games:
+            checkpoint.record(pending_games, writer.write(pending_rows) if pending_rows else writer.position())
+            pending_rows, pending_games = [], []
+
+    def collect(result):
+        nonlocal analysed, errors, moves
+        if result["error"]:
+            errors += 1
+            print(f"Error analysing the game at {result['file']}:{result['offset']}: {result['error']}", file=sys.stderr)
+        pending_rows.extend(result["rows"])
+        pending_games.append([result["file"], result["offset"]])
+        analysed += 1
+        moves += len(result["rows"])
+        if len(pending_games) >= args.flush_games:
+            flush()
+            elapsed = time.perf_counter() - started
+            print(f"{analysed} games, {moves} moves, {analysed / elapsed:.2f} games/s", file=sys.stderr)
+
+    games = ((path, offset, index) for path, offset, index in scan_games([os.path.abspath(path) for path in args.inputs]) if (path, offset) not in checkpoint.done)
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker) as pool:
+        # A bounded number of games in flight keeps the scan from running ahead of the workers
+        in_flight = set()
+        for game in games:
+            if args.max_games and analysed + len(in_flight) >= args.max_games:
+                break
+            in_flight.add(pool.submit(analyze_game, *game, args.profile))
+            if len(in_flight) >= workers * 2:
+                finished, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    collect(future.result())
+        for future in concurrent.futures.as_completed(in_flight):
+            collect(future.result())
+    flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"Done: {analysed} games, {moves} moves, {errors} errors in {elapsed:.1f}s", file=sys.stderr)
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="PGN files")
+    parser.add_argument("--output", required=True, help="JSONL file, or a directory of Parquet part files")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), help="defaults to parquet for a .parquet output, jsonl otherwise")
+    parser.add_argument("--profile", default="standard", help="analysis profile, see routes.chess_review.ANALYSIS_PROFILES")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, one engine each, defaults to the number of cores")
+    parser.add_argument("--engine-threads", type=int, default=1, help="threads of every worker's engine")
+    parser.add_argument("--flush-games", type=int, default=100, help="games per output chunk and checkpoint")
+    parser.add_argument("--max-games", type=int, default=0, help="stop after this many games in this run")
+    parser.add_argument("--checkpoint", help="defaults to the output path with .checkpoint appended")
+    parser.add_argument("--no-eval-cache", action="store_true", help="do not read or fill the evaluation cache")
+    args = parser.parse_args()
+
+    sys.exit(1 if run(args) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,41 @@
-import io
+import contextlib
 import os
-import tempfile
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse, StreamingResponse
-from PIL import Image, UnidentifiedImageError
+from fastapi import FastAPI, File, UploadFile, Form, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from PIL import UnidentifiedImageError
 import uvicorn
-from routes.segmentation import segment_chess_board
-from routes.detection import detect_pieces
-from routes.fen_generator import gen_fen
-from routes.chess_review import analyze_pgn
-from typing import List, Dict, Any, Union
-from pydantic import BaseModel
+from routes.segmentation import segment_chess_board, seg_model
+from routes.detection import detect_pieces, detect_model
+from routes.fen_generator import gen_fen_with_confidence
+from routes.tex_based_review import close_client as close_text_review_client
+from routes.chess_review import review_game, collect_review, parse_game, ANALYSIS_PROFILES, DEFAULT_PROFILE
+from routes.engine_pool import engine_pool, EnginePoolTimeout
+from routes.eval_cache import eval_cache
+from routes.review_cache import review_cache
+from routes.classifier import reclassify, rules_from_dict
+from routes.position_analysis import analyze_position, parse_position, search_limit
+from routes.review_jobs import review_jobs
+from routes.execution import ConcurrencyLimitMiddleware, run_inference
+from routes.image_pipeline import decode_image, resize_into, board_buffers, dhash
+from routes.fen_cache import fen_cache
+from routes.board_tracker import BoardTracker, TRACK_MAX_SESSIONS
+from routes.metrics import registry, stage_timer, MetricsMiddleware
+from typing import List, Dict, Any, Optional, Tuple, Union
+from pydantic import BaseModel, ValidationError
 import asyncio
 import sys
 import tracemalloc
 from fastapi import requests
 import base64
+import json
 
-tracemalloc.start()
+# Tracing every allocation slows the whole server down, TRACEMALLOC=1 keeps it on from startup
+# and ENABLE_PROFILING=1 allows sampling it for a few seconds through /debug/tracemalloc
+TRACEMALLOC = os.getenv("TRACEMALLOC", "0") == "1"
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "1"))
+ENABLE_PROFILING = os.getenv("ENABLE_PROFILING", "0") == "1"
+if TRACEMALLOC:
+    tracemalloc.start(TRACEMALLOC_FRAMES)
 
 
 if sys.platform == "win32":
@@ -26,6 +44,54 @@ if sys.platform == "win32":
 
 app = FastAPI()
 
+# Heavy endpoints answer 503 with Retry-After once this many requests are in flight
+app.add_middleware(
+    ConcurrencyLimitMiddleware,
+    limits={
+        "/getFen": int(os.getenv("FEN_CONCURRENCY", "16")),
+        "/getReview": int(os.getenv("REVIEW_CONCURRENCY", "8")),
+        "/getReviewStream": int(os.getenv("REVIEW_CONCURRENCY", "8")),
+        "/analyzePosition": int(os.getenv("POSITION_CONCURRENCY", "16")),
+    },
+    retry_after=int(os.getenv("RETRY_AFTER_SECONDS", "5")),
+)
+# Outermost, so requests rejected by the concurrency limit are timed too
+app.add_middleware(MetricsMiddleware)
+
+
+# Review-only deployments set ENABLE_FEN=0 and never load torch or the YOLO models
+ENABLE_FEN = os.getenv("ENABLE_FEN", "1") == "1"
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "0") == "1"
+WARMUP_MODELS = os.getenv("WARMUP_MODELS", "1") == "1"
+ENGINE_PRESTART = int(os.getenv("ENGINE_PRESTART", "1"))
+
+
+async def preload_models():
+    for model in (seg_model, detect_model):
+        try:
+            if WARMUP_MODELS:
+                await run_inference(model.warmup)
+            else:
+                await run_inference(model.get)
+        except Exception as e:
+            print(f"Error preloading {model.pt_path}: {e}")
+
+
+@app.on_event("startup")
+async def startup():
+    # both run in the background, /readyz reports when they are done
+    if ENABLE_FEN and PRELOAD_MODELS:
+        asyncio.create_task(preload_models())
+    if ENGINE_PRESTART:
+        asyncio.create_task(engine_pool.prestart(ENGINE_PRESTART))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await review_jobs.close()
+    await engine_pool.close()
+    await close_text_review_client()
+
 class DetectionResults(BaseModel):
     boxes: list
     confidences: list
@@ -33,6 +99,90 @@ class DetectionResults(BaseModel):
 
 class FileUpload(BaseModel):
     file_data : str
+    profile : str = DEFAULT_PROFILE
+
+class ReclassifyRequest(FileUpload):
+    rules : Dict[str, Any] = {}
+
+class PositionRequest(BaseModel):
+    fen : Optional[str] = None
+    depth : Optional[int] = None
+    nodes : Optional[int] = None
+    multipv : int = 1
+    # only used with an image instead of a fen
+    perspective : str = "w"
+    next_to_move : str = "w"
+
+PGN_CONTENT_TYPES = ("text/plain", "application/x-chess-pgn", "application/vnd.chess-pgn")
+
+# /getReview and /getReviewStream take the pgn in any of these bodies, documented here since the body is read by hand
+PGN_UPLOAD_OPENAPI = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": FileUpload.model_json_schema()},
+    "multipart/form-data": {"schema": {"type": "object", "required": ["file"], "properties": {
+        "file": {"type": "string", "format": "binary"}, "profile": {"type": "string", "default": DEFAULT_PROFILE}}}},
+    **{content_type: {"schema": {"type": "string"}} for content_type in PGN_CONTENT_TYPES},
+}}}
+
+# /analyzePosition takes a fen as JSON, or a form with a fen or an image file
+POSITION_OPENAPI = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": PositionRequest.model_json_schema()},
+    "multipart/form-data": {"schema": {"type": "object", "properties": {
+        "file": {"type": "string", "format": "binary"}, **PositionRequest.model_json_schema()["properties"]}}},
+}}}
+
+async def read_pgn_upload(request: Request) -> Tuple[str, str]:
+    # (pgn text, profile) of a JSON body with base64 file_data, a multipart form with a file field,
+    # or the raw pgn as any other body with the profile in the query string
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        form = await request.form()
+        upload = form.get("file")
+        data = await upload.read() if hasattr(upload, "read") else (upload or "").encode()
+        return data.decode("utf-8", errors="replace"), form.get("profile") or request.query_params.get("profile", DEFAULT_PROFILE)
+
+    body = await request.body()
+    # A pgn starts with a tag or a move, never with "{", so untyped JSON is still recognised. Anything
+    # else is pgn text, also without a content type or as curl --data-binary's form encoding.
+    if content_type == "application/json" or content_type.endswith("+json") or (content_type not in PGN_CONTENT_TYPES and body.lstrip().startswith(b"{")):
+        file_upload = FileUpload.model_validate_json(body)
+        return base64.b64decode(file_upload.file_data).decode("utf-8", errors="replace"), file_upload.profile
+    return body.decode("utf-8", errors="replace"), request.query_params.get("profile", DEFAULT_PROFILE)
+
+async def read_review_request(request: Request):
+    # (game, pgn text, profile) or the error response to send instead
+    try:
+        pgn_text, profile = await read_pgn_upload(request)
+    except ValidationError as e:
+        return JSONResponse(content={"detail": json.loads(e.json())}, status_code=422)
+    except ValueError as e:
+        return JSONResponse(content={"error": "Invalid upload", "details": str(e)}, status_code=400)
+    if not pgn_text.strip():
+        return JSONResponse(content={"error": "Empty file uploaded"}, status_code=400)
+    if profile not in ANALYSIS_PROFILES:
+        return JSONResponse(content={"error": f"profile should be one of {', '.join(ANALYSIS_PROFILES)}"}, status_code=400)
+    game = parse_game(pgn_text)
+    if not game:
+        return JSONResponse(content={"error": "No game found in the PGN file"}, status_code=400)
+    return game, pgn_text, profile
+
+
+@app.get("/healthz")
+async def healthz():
+    # liveness only, the process is up and serving requests
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    models = {"segmentation": seg_model.status(), "detection": detect_model.status()} if ENABLE_FEN else {}
+    models_ready = not (ENABLE_FEN and PRELOAD_MODELS) or all(m["loaded"] and (m["warm"] or not WARMUP_MODELS) for m in models.values())
+    engines_ready = not ENGINE_PRESTART or engine_pool.ready
+    content = {
+        "ready": models_ready and engines_ready,
+        "models": models,
+        "engine_pool": engine_pool.status(),
+    }
+    return JSONResponse(content=content, status_code=200 if content["ready"] else 503)
 
 
 @app.get("/test")
@@ -44,9 +194,111 @@ async def read_root():
     }
     
 
+@app.get("/evalCacheStats")
+async def eval_cache_stats():
+    return eval_cache.stats()
+
+
+@app.get("/fenCacheStats")
+async def fen_cache_stats():
+    return fen_cache.stats()
+
+
+@registry.collector
+def runtime_metrics():
+    # values kept by the caches and pools themselves, read on every scrape
+    eval_stats = eval_cache.stats()
+    fen_stats = fen_cache.stats()
+    review_stats = review_cache.stats()
+    pool = engine_pool.status()
+    families = [
+        ("chess_eval_cache_lookups_total", "counter", "Evaluation cache lookups by result",
+            [("chess_eval_cache_lookups_total", {"result": result}, eval_stats[result]) for result in ("memory_hits", "disk_hits", "misses")]),
+        ("chess_eval_cache_entries", "gauge", "Positions in the evaluation cache by tier",
+            [("chess_eval_cache_entries", {"tier": "memory"}, eval_stats["memory_entries"]), ("chess_eval_cache_entries", {"tier": "disk"}, eval_stats["disk_entries"])]),
+        ("chess_fen_cache_lookups_total", "counter", "FEN cache lookups by result",
+            [("chess_fen_cache_lookups_total", {"result": result}, fen_stats[result]) for result in ("hits", "misses", "coalesced")]),
+        ("chess_fen_cache_entries", "gauge", "Results in the FEN cache", [("chess_fen_cache_entries", {}, fen_stats["entries"])]),
+        ("chess_review_cache_lookups_total", "counter", "Review cache lookups by result",
+            [("chess_review_cache_lookups_total", {"result": result}, review_stats[result]) for result in ("hits", "misses")]),
+        ("chess_review_cache_entries", "gauge", "Reviews in the review cache", [("chess_review_cache_entries", {}, review_stats["entries"])]),
+        ("chess_review_evaluation_lookups_total", "counter", "Stored engine evaluation lookups by result",
+            [("chess_review_evaluation_lookups_total", {"result": result}, review_stats["evaluation_" + result]) for result in ("hits", "misses")]),
+        ("chess_review_evaluations", "gauge", "Engine evaluations in the review cache", [("chess_review_evaluations", {}, review_stats["evaluations"])]),
+        ("chess_engine_pool_engines", "gauge", "Engine processes by state",
+            [("chess_engine_pool_engines", {"state": state}, pool[state]) for state in ("size", "running", "in_use", "waiting")]),
+        ("chess_track_sessions", "gauge", "Open /trackBoard sessions", [("chess_track_sessions", {}, track_sessions)]),
+    ]
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        families.append(("python_traced_memory_bytes", "gauge", "Memory traced by tracemalloc",
+            [("python_traced_memory_bytes", {"kind": "current"}, current), ("python_traced_memory_bytes", {"kind": "peak"}, peak)]))
+    return families
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/tracemalloc")
+async def sample_tracemalloc(seconds: float = 10, limit: int = 20):
+    # top allocations still alive after tracing for `seconds`, or of the whole run when TRACEMALLOC is on
+    if not ENABLE_PROFILING:
+        return JSONResponse(content={"error": "Profiling is disabled on this server"}, status_code=404)
+
+    sampling = not tracemalloc.is_tracing()
+    if sampling:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        await asyncio.sleep(min(max(seconds, 0), 300))
+    try:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if sampling:
+            tracemalloc.stop()
+
+    top = snapshot.statistics("lineno")[:limit]
+    return {
+        "sampled_seconds": seconds if sampling else None,
+        "traced_bytes": current,
+        "peak_traced_bytes": peak,
+        "top": [{"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count} for stat in top],
+    }
+
+
+async def fen_from_image(image, perspective, next_to_move):
+    # returns the response content and status code for a decoded upload
+
+    # the board is a view into the decoded frame, resized once into a pooled buffer
+    with stage_timer("fen", "segmentation"):
+        segmented_image = await segment_chess_board(image)
+    if isinstance(segmented_image, dict):
+        return segmented_image, 400
+
+    with board_buffers.borrow() as board_buffer:
+        with stage_timer("fen", "resize"):
+            segmented_image = await run_inference(resize_into, segmented_image, board_buffer)
+        with stage_timer("fen", "detection"):
+            detection_results = await detect_pieces(segmented_image)
+    if "error" in detection_results:
+        return detection_results, 400
+
+    # square_confidence lets clients flag boards with uncertain detections
+    with stage_timer("fen", "gen_fen"):
+        fen, square_confidence = gen_fen_with_confidence(detection_results, perspective, next_to_move)
+    if not fen:
+        return {"error": "FEN generation failed", "details": "Invalid input data"}, 500
+
+    return {"FEN": fen, "square_confidence": square_confidence}, 200
+
+
 @app.post("/getFen")
 async def get_fen(file : UploadFile = File(), perspective : str = Form("w"), next_to_move : str = Form("w")):
 
+    if not ENABLE_FEN:
+        return JSONResponse(content={"error": "FEN detection is disabled on this server"}, status_code=503)
+
     if perspective not in ["w" , "b"]:
         return JSONResponse(content={"error" : "Perspective should be w (white) or b (black)"}, status_code=500)
     
@@ -59,58 +311,296 @@ async def get_fen(file : UploadFile = File(), perspective : str = Form("w"), nex
         if not image_content:
             return JSONResponse(content={"error": "Empty file uploaded"}, status_code=400)
 
+        content, status_code = await fen_for_upload(image_content, perspective, next_to_move)
+        return JSONResponse(content=content, status_code=status_code)
+    
+    except Exception as e:
+        return JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
+
+
+async def fen_for_upload(image_content, perspective, next_to_move):
+    # response content and status code for an encoded upload, served from the FEN cache when possible
+    if fen_cache.mode == "phash":
+        # near-identical images share a perceptual hash, which needs the decoded frame
         try:
-            image = Image.open(io.BytesIO(image_content))
+            with stage_timer("fen", "decode"):
+                image = await run_inference(decode_image, image_content)
         except UnidentifiedImageError:
-            return JSONResponse(content={"error": "Invalid image format"}, status_code=400)
+            return {"error": "Invalid image format"}, 400
+        key = fen_cache.perceptual_key(await run_inference(dhash, image), perspective, next_to_move)
 
-        segmented_image = await segment_chess_board(image)
-        if isinstance(segmented_image, dict):
-            return JSONResponse(content=segmented_image, status_code=400)
+        async def compute():
+            return await fen_from_image(image, perspective, next_to_move)
+    else:
+        key = await run_inference(fen_cache.exact_key, image_content, perspective, next_to_move)
 
-        segmented_image = segmented_image.resize((224, 224))
+        async def compute():
+            try:
+                with stage_timer("fen", "decode"):
+                    image = await run_inference(decode_image, image_content)
+            except UnidentifiedImageError:
+                return {"error": "Invalid image format"}, 400
+            return await fen_from_image(image, perspective, next_to_move)
 
-        detection_results = await detect_pieces(segmented_image)
-        if "error" in detection_results:
-            return JSONResponse(content=detection_results, status_code=400)
-        
-        fen = gen_fen(detection_results, perspective, next_to_move)
-        if not fen:
-            return JSONResponse(content={"error": "FEN generation failed", "details": "Invalid input data"}, status_code=500)
+    # identical concurrent uploads wait for one inference instead of running their own
+    if fen_cache.enabled:
+        return await fen_cache.get_or_compute(key, compute, cacheable=lambda result: result[1] == 200)
+    return await compute()
 
-        return JSONResponse(content={"FEN": fen}, status_code=200)
-    
+
+track_sessions = 0
+
+
+@app.websocket("/trackBoard")
+async def track_board(websocket: WebSocket, perspective: str = "w", next_to_move: str = "w"):
+    # binary messages are encoded frames, every change of position is sent back as {"type": "fen", "data": {...}}
+    global track_sessions
+    await websocket.accept()
+    if not ENABLE_FEN or track_sessions >= TRACK_MAX_SESSIONS:
+        await websocket.close(code=1013, reason="Server is busy, try again later")
+        return
+    if perspective not in ["w", "b"] or next_to_move not in ["w", "b"]:
+        await websocket.close(code=1008, reason="perspective and next_to_move should be w or b")
+        return
+
+    track_sessions += 1
+    tracker = BoardTracker(perspective, next_to_move)
+    latest_frame = None
+    frame_ready = asyncio.Event()
+    dropped = 0
+
+    async def receive_frames():
+        # only the newest frame is kept, frames arriving while one is processed are dropped
+        nonlocal latest_frame, dropped
+        while True:
+            message = await websocket.receive_bytes()
+            if latest_frame is not None:
+                dropped += 1
+            latest_frame = message
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            waiter = asyncio.create_task(frame_ready.wait())
+            await asyncio.wait({waiter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                waiter.cancel()
+                receiver.result()
+            frame, latest_frame = latest_frame, None
+            frame_ready.clear()
+
+            try:
+                image = await run_inference(decode_image, frame)
+            except UnidentifiedImageError:
+                await websocket.send_json({"type": "error", "data": {"error": "Invalid image format"}})
+                continue
+            event = await tracker.update(image)
+            if event is not None:
+                event.setdefault("data", {})["stats"] = {**tracker.stats(), "dropped": dropped}
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        return JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
-    
-@app.post('/getReview')
-async def getReview(file_upload: FileUpload):  
-    # this function returns text based and overall review of the game by taking base64 encoded pgn file as input
+        with contextlib.suppress(Exception):
+            await websocket.close(code=1011, reason=str(e)[:120])
+    finally:
+        receiver.cancel()
+        track_sessions -= 1
+
+
+@app.post('/getReview', openapi_extra=PGN_UPLOAD_OPENAPI)
+async def getReview(request: Request):
+    # this function returns text based and overall review of the game, the pgn is parsed once in memory
     print(os.getcwd())
     print("call recieved")
 
+    parsed = await read_review_request(request)
+    if isinstance(parsed, JSONResponse):
+        return parsed
+    game, pgn_text, profile = parsed
+    try:
+        # the engine is borrowed from the shared pool
+        return JSONResponse(content=await collect_review(game, pgn_text, profile))
+
+    except EnginePoolTimeout as e:
+        return JSONResponse(content={"error": "All engines are busy, try again later", "details": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    except Exception as e:
+        return  JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
+
+
+@app.get('/reviewCacheStats')
+async def review_cache_stats():
+    return review_cache.stats()
+
+
+@app.post('/reviewCache/invalidate')
+async def invalidateReviewCache(file_upload: FileUpload):
+    # drops the cached reviews of the base64 encoded game under every profile and engine
     if not file_upload.file_data:
         return JSONResponse(content={"error": "Empty file uploaded"}, status_code=400)
     try:
-        file_data = base64.b64decode(file_upload.file_data)
-        # Save the uploaded file to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pgn") as tmp_file:
-            tmp_file.write(file_data)
-            tmp_file_path = tmp_file.name
+        game = parse_game(base64.b64decode(file_upload.file_data).decode("utf-8", errors="replace"))
+    except Exception as e:
+        return JSONResponse(content={"error": "Invalid PGN", "details": str(e)}, status_code=400)
+    if game is None:
+        return JSONResponse(content={"error": "No game found in the PGN file"}, status_code=400)
+    return {"removed": review_cache.invalidate(review_cache.game_key(game))}
 
-        # Analyze the PGN file
-        analysis_result = analyze_pgn(tmp_file_path)
 
-        # Clean up the temporary file
-        os.remove(tmp_file_path)
+@app.delete('/reviewCache')
+async def clearReviewCache():
+    return {"removed": review_cache.invalidate()}
 
-        if not analysis_result:
-            return JSONResponse(content={"error": "No game found in the PGN file"}, status_code=400)
-        return analysis_result
-    
+
+@app.post('/reclassify')
+async def reclassifyGame(request: ReclassifyRequest):
+    # classifies a reviewed game again from its stored engine evaluation, with the default or the given rules
+    if not request.file_data:
+        return JSONResponse(content={"error": "Empty file uploaded"}, status_code=400)
+    if request.profile not in ANALYSIS_PROFILES:
+        return JSONResponse(content={"error": f"profile should be one of {', '.join(ANALYSIS_PROFILES)}"}, status_code=400)
+    try:
+        rules = rules_from_dict(request.rules)
+    except (ValueError, TypeError) as e:
+        return JSONResponse(content={"error": "Invalid classification rules", "details": str(e)}, status_code=400)
+    try:
+        game = parse_game(base64.b64decode(request.file_data).decode("utf-8", errors="replace"))
     except Exception as e:
-        return  JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
-    
+        return JSONResponse(content={"error": "Invalid PGN", "details": str(e)}, status_code=400)
+    if game is None:
+        return JSONResponse(content={"error": "No game found in the PGN file"}, status_code=400)
+
+    profile_key = f"{request.profile}:{ANALYSIS_PROFILES[request.profile]}"
+    key = review_cache.evaluation_key(review_cache.game_key(game), profile_key, engine_pool.fingerprint())
+    evaluation = review_cache.get_evaluation(key)
+    if evaluation is None:
+        return JSONResponse(content={"error": "The game has not been reviewed with this profile and engine"}, status_code=404)
+    with stage_timer("review", "reclassify"):
+        return reclassify(evaluation, rules, game.headers)
+
+
+@app.post('/analyzePosition', openapi_extra=POSITION_OPENAPI)
+async def analyzePosition(request: Request):
+    # evaluation and best lines of one position, given as a fen or as a board image run through the FEN pipeline first
+    image_content = None
+    try:
+        if request.headers.get("content-type", "").split(";")[0].strip().lower() in ("multipart/form-data", "application/x-www-form-urlencoded"):
+            form = await request.form()
+            upload = form.get("file")
+            image_content = await upload.read() if hasattr(upload, "read") else None
+            position = PositionRequest.model_validate({key: value for key, value in form.items() if key != "file" and value != ""})
+        else:
+            position = PositionRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        return JSONResponse(content={"detail": json.loads(e.json())}, status_code=422)
+
+    fen_result = None
+    if image_content:
+        if not ENABLE_FEN:
+            return JSONResponse(content={"error": "FEN detection is disabled on this server"}, status_code=503)
+        if position.perspective not in ["w", "b"] or position.next_to_move not in ["w", "b"]:
+            return JSONResponse(content={"error": "perspective and next_to_move should be w or b"}, status_code=400)
+        try:
+            fen_result, status_code = await fen_for_upload(image_content, position.perspective, position.next_to_move)
+        except Exception as e:
+            return JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
+        if status_code != 200:
+            return JSONResponse(content=fen_result, status_code=status_code)
+        fen = fen_result["FEN"]
+    elif position.fen:
+        fen = position.fen
+    else:
+        return JSONResponse(content={"error": "Send a fen or an image file"}, status_code=400)
+
+    try:
+        board = parse_position(fen)
+        limit = search_limit(position.depth, position.nodes)
+        result = await analyze_position(board, limit, position.multipv)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e), "fen": fen}, status_code=400)
+    except EnginePoolTimeout as e:
+        return JSONResponse(content={"error": "All engines are busy, try again later", "details": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    except Exception as e:
+        return JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
+
+    if fen_result is not None:
+        result["square_confidence"] = fen_result["square_confidence"]
+    return result
+
+
+@app.post('/getReviewStream', openapi_extra=PGN_UPLOAD_OPENAPI)
+async def getReviewStream(request: Request):
+    # same review as /getReview, streamed as NDJSON: one {"type": "move"} line per move
+    # as soon as it is classified, then a {"type": "summary"} line with the remaining keys
+    parsed = await read_review_request(request)
+    if isinstance(parsed, JSONResponse):
+        return parsed
+    game, pgn_text, profile = parsed
+
+    try:
+        # Wait for the first event so pool exhaustion is still reported as a 503
+        events = review_game(game, pgn_text, profile)
+        first_event = await anext(events, None)
+
+    except EnginePoolTimeout as e:
+        return JSONResponse(content={"error": "All engines are busy, try again later", "details": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    except Exception as e:
+        return JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
+
+    async def stream():
+        try:
+            if first_event is not None:
+                yield json.dumps(first_event) + "\n"
+            async for event in events:
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "data": {"error": "Unexpected error occurred", "details": str(e)}}) + "\n"
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post('/reviewJobs')
+async def submitReviewJob(file_upload: FileUpload):
+    # queues every game of a base64 encoded multi-game pgn file for review and returns the job id
+    if not file_upload.file_data:
+        return JSONResponse(content={"error": "Empty file uploaded"}, status_code=400)
+
+    if file_upload.profile not in ANALYSIS_PROFILES:
+        return JSONResponse(content={"error": f"profile should be one of {', '.join(ANALYSIS_PROFILES)}"}, status_code=400)
+    try:
+        job = await review_jobs.submit(base64.b64decode(file_upload.file_data), file_upload.profile)
+        return JSONResponse(content=job.summary(), status_code=202)
+    except Exception as e:
+        return JSONResponse(content={"error": "Unexpected error occurred", "details": str(e)}, status_code=500)
+
+
+@app.get('/reviewJobs/{job_id}')
+async def getReviewJob(job_id: str):
+    job = review_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return job.summary()
+
+
+@app.get('/reviewJobs/{job_id}/results')
+async def getReviewJobResults(job_id: str):
+    # NDJSON with one {"game_index", "headers", "review" | "error"} line per game, follows the job until it finishes
+    job = review_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return StreamingResponse(review_jobs.stream_results(job), media_type="application/x-ndjson")
+
+
+@app.delete('/reviewJobs/{job_id}')
+async def deleteReviewJob(job_id: str):
+    if review_jobs.get(job_id) is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    await review_jobs.remove(job_id)
+    return {"job_id": job_id, "status": "deleted"}
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=7860)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import cv2
+import numpy as np
+from routes.segmentation import seg_batcher, board_bbox
+from routes.detection import detect_pieces
+from routes.fen_generator import gen_fen_with_confidence
+from routes.execution import run_inference
+from routes.image_pipeline import crop_view, resize_into, board_buffers
+
+
+# A square counts as changed when its mean absolute grey level difference exceeds this
+TRACK_SQUARE_THRESHOLD = float(os.getenv("TRACK_SQUARE_THRESHOLD", "12"))
+# More changed squares than this means the camera or the board moved, not a piece
+TRACK_DRIFT_SQUARES = int(os.getenv("TRACK_DRIFT_SQUARES", "24"))
+# The board is re-segmented at least this often even when nothing seems to drift
+TRACK_RESEGMENT_FRAMES = int(os.getenv("TRACK_RESEGMENT_FRAMES", "150"))
+TRACK_MAX_SESSIONS = int(os.getenv("TRACK_MAX_SESSIONS", "4"))
+
+THUMBNAIL_SIZE = 64
+
+
+def board_thumbnail(board: np.ndarray) -> np.ndarray:
+    # Small greyscale copy of the board region, 8x8 pixels per square, for cheap frame differencing
+    gray = cv2.cvtColor(board, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def changed_squares(previous: np.ndarray, current: np.ndarray, threshold: float = TRACK_SQUARE_THRESHOLD) -> int:
+    block = THUMBNAIL_SIZE // 8
+    difference = cv2.absdiff(previous, current).astype(np.float32)
+    per_square = difference.reshape(8, block, 8, block).mean(axis=(1, 3))
+    return int((per_square > threshold).sum())
+
+
+class BoardTracker:
+    """Follows one board through a stream of frames.
+
+    The board is segmented on the first frame and its box is reused until the
+    board region drifts (too many squares change at once), the board is lost or
+    ``TRACK_RESEGMENT_FRAMES`` frames have passed. Pieces are detected only once
+    a change in the board region has settled, i.e. the frame matches the one
+    before it but differs from the last detected one, so frames with a hand
+    over the board are skipped. ``update`` returns an event only when there is
+    something new to report.
+    """
+
+    def __init__(self, perspective: str = "w", next_to_move: str = "w"):
+        self.perspective = perspective
+        self.next_to_move = next_to_move
+        self.bbox = None
+        self.fen = None
+        self.frames = 0
+        self.frames_since_segmentation = 0
+        self.counters = {"segmentations": 0, "detections": 0, "skipped": 0}
+        self._previous = None
+        self._detected = None
+
+    async def _segment(self, frame: np.ndarray):
+        self.counters["segmentations"] += 1
+        self.frames_since_segmentation = 0
+        bbox = board_bbox([await seg_batcher.submit(frame)])
+        self.bbox = None if isinstance(bbox, dict) else bbox
+        self._previous = None
+        self._detected = None
+
+    async def _detect(self, board: np.ndarray):
+        self.counters["detections"] += 1
+        with board_buffers.borrow() as board_buffer:
+            board = await run_inference(resize_into, board, board_buffer)
+            detection_results = await detect_pieces(board)
+        if "error" in detection_results:
+            return None, None
+        return gen_fen_with_confidence(detection_results, self.perspective, self.next_to_move)
+
+    async def update(self, frame: np.ndarray):
+        self.frames += 1
+        self.frames_since_segmentation += 1
+        had_board = self.bbox is not None
+
+        if self.bbox is None or self.frames_since_segmentation > TRACK_RESEGMENT_FRAMES:
+            await self._segment(frame)
+        board = crop_view(frame, *self.bbox) if self.bbox is not None else None
+        if board is None or board.size == 0:
+            self.bbox = None
+            return {"type": "board_lost"} if had_board or self.frames == 1 else None
+        thumbnail = await run_inference(board_thumbnail, board)
+
+        previous, self._previous = self._previous, thumbnail
+        if self._detected is not None:
+            changed = changed_squares(self._detected, thumbnail)
+            if changed == 0:
+                self.counters["skipped"] += 1
+                return None
+            if changed > TRACK_DRIFT_SQUARES:
+                # The board moved in the frame, find it again before trusting the box
+                await self._segment(frame)
+                return {"type": "board_lost"} if self.bbox is None else None
+        if previous is None or changed_squares(previous, thumbnail) > 0:
+            # Still moving, wait for the position to settle
+            self.counters["skipped"] += 1
+            return None
+
+        fen, square_confidence = await self._detect(board)
+        self._detected = thumbnail
+        if fen is None or fen == self.fen:
+            return None
+        self.fen = fen
+        return {"type": "fen", "data": {"FEN": fen, "square_confidence": square_confidence, "frame": self.frames}}
+
+    def stats(self):
+        return {**self.counters, "frames": self.frames, "bbox": self.bbox, "FEN": self.fen}
@@ -1,315 +1,304 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
+import io
 import os
 import tempfile
 import chess.pgn
 import chess.engine
 from enum import Enum
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, NamedTuple, Optional, Tuple, Union
 from datetime import datetime
-import csv
 import json
 from fastapi.responses import JSONResponse
 import asyncio
+import collections
+import contextlib
 import sys
-from routes.tex_based_review import review_chess_game, validate_json
+import time
+from routes.tex_based_review import text_review, validate_json
+from routes.engine_pool import engine_pool
+from routes.eval_cache import eval_cache
+from routes.review_cache import review_cache
+from routes.opening_book import load_opening_book, is_book_move
+from routes.execution import run_blocking_io
+from routes.classifier import GamePhase, Classification, classification_values, centipawn_classifications, detect_game_phase, get_evaluation_loss_threshold, get_phase_rating, new_evaluation, add_position, classify, summarize, player_summaries
+from routes.metrics import stage_seconds, stage_timer, engine_searches, engine_search_nodes, engine_search_seconds
 
 
 
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
-class GamePhase(Enum):
-    OPENING = "opening"
-    MIDDLEGAME = "middlegame"
-    ENDGAME = "endgame"
-
-class Classification(Enum):
-    BRILLIANT = "brilliant"
-    GREAT = "great"
-    BEST = "best"
-    EXCELLENT = "excellent"
-    GOOD = "good"
-    INACCURACY = "inaccuracy"
-    MISTAKE = "mistake"
-    MISS = "miss"
-    BLUNDER = "blunder"
-    BOOK = "book"
-    FORCED = "forced"
-
-classification_values = {
-    Classification.BLUNDER: 0,
-    Classification.MISTAKE: 0.2,
-    Classification.MISS: 0.3,
-    Classification.INACCURACY: 0.4,
-    Classification.GOOD: 0.65,
-    Classification.EXCELLENT: 0.9,
-    Classification.BEST: 1,
-    Classification.GREAT: 1,
-    Classification.BRILLIANT: 1,
-    Classification.BOOK: 1,
-    Classification.FORCED: 1,
+book_csv_path = os.path.join(os.getcwd(), "assets", "openings_master.csv")
+# Compiled once per process, lookups are by Zobrist hash
+with stage_timer("review", "opening_book_load"):
+    opening_book = load_opening_book(book_csv_path)
+
+# Upper bound on the engines a single review may use at the same time
+REVIEW_MAX_PARALLELISM = int(os.getenv("REVIEW_MAX_PARALLELISM", "4"))
+
+class AnalysisProfile(NamedTuple):
+    limit: chess.engine.Limit  # positions that feed a classified move
+    book_limit: chess.engine.Limit  # positions only surrounded by book moves
+
+ANALYSIS_PROFILES = {
+    "fast": AnalysisProfile(chess.engine.Limit(depth=12), chess.engine.Limit(depth=6)),
+    "standard": AnalysisProfile(chess.engine.Limit(depth=18), chess.engine.Limit(depth=10)),
+    "deep": AnalysisProfile(chess.engine.Limit(depth=24), chess.engine.Limit(depth=14)),
 }
+DEFAULT_PROFILE = "standard"
+
+def game_positions(game: chess.pgn.Game) -> List[chess.Board]:
+    # Position before the first move followed by the position after every mainline move
+    board = game.board()
+    positions = [board.copy()]
+    for move in game.mainline_moves():
+        board.push(move)
+        positions.append(board.copy())
+    return positions
+
+def plan_searches(positions: List[chess.Board], book_moves: List, forced_moves: List[bool], profile: AnalysisProfile) -> List[Optional[chess.engine.Limit]]:
+    # Position i is the pre position of ply i and the post position of ply i - 1.
+    # It gets a full search if either of those plies is classified by evaluation
+    # loss, a short one if both are book moves, and none at all if its only legal
+    # move is forced, since then it is derived from the next position.
+    plies = len(positions) - 1
+    classified = [not book_moves[ply] and not forced_moves[ply] for ply in range(plies)]
+    full = [(i < plies and classified[i]) or (i > 0 and classified[i - 1]) for i in range(len(positions))]
+    for i in range(plies):
+        if forced_moves[i] and full[i]:
+            full[i + 1] = True
+
+    limits = []
+    for i in range(len(positions)):
+        if i < plies and forced_moves[i]:
+            limits.append(None)
+        else:
+            limits.append(profile.limit if full[i] else profile.book_limit)
+    return limits
+
+def forced_move_info(board: chess.Board, move: chess.Move, next_info: Dict) -> Dict:
+    # With a single legal move the evaluation is the one after it, one ply deeper
+    score = next_info["score"].pov(board.turn)
+    if score.is_mate() and score > chess.engine.Cp(0):
+        score = chess.engine.Mate(score.mate() + 1)
+    return {
+        "score": chess.engine.PovScore(score, board.turn),
+        "pv": [move] + next_info.get("pv", []),
+    }
 
-centipawn_classifications = [
-    Classification.BEST,
-    Classification.EXCELLENT,
-    Classification.GOOD,
-    Classification.INACCURACY,
-    Classification.MISS,
-    Classification.MISTAKE,
-    Classification.BLUNDER,
-]
-
-# Analysis parameters
-FORCED_WIN_THRESHOLD = 500
-MISS_CENTIPAWN_LOSS = 300
-MISS_MATE_THRESHOLD = 3
-ENDGAME_MATERIAL_THRESHOLD = 24
-QUEEN_VALUE = 9
-
-def detect_game_phase(board: chess.Board, in_opening: bool) -> GamePhase:
-    if in_opening:
-        return GamePhase.OPENING
-        
-    total_material = 0
-    queens = 0
-    
-    for color in [chess.WHITE, chess.BLACK]:
-        for piece_type in chess.PIECE_TYPES:
-            if piece_type == chess.KING:
-                continue
-                
-            count = len(board.pieces(piece_type, color))
-            value = {
-                chess.PAWN: 1,
-                chess.KNIGHT: 3,
-                chess.BISHOP: 3,
-                chess.ROOK: 5,
-                chess.QUEEN: QUEEN_VALUE
-            }[piece_type]
-            
-            total_material += count * value
-            if piece_type == chess.QUEEN:
-                queens += count
-
-    endgame_conditions = [
-        total_material <= ENDGAME_MATERIAL_THRESHOLD,
-        queens == 0 and total_material <= ENDGAME_MATERIAL_THRESHOLD * 2,
-    ]
-    
-    return GamePhase.ENDGAME if any(endgame_conditions) else GamePhase.MIDDLEGAME
-
-def get_evaluation_loss_threshold(classif: Classification, prev_eval: float) -> float:
-    prev_eval = abs(prev_eval)
-    if classif == Classification.BEST:
-        return max(0.0001 * prev_eval**2 + 0.0236 * prev_eval - 3.7143, 0)
-    elif classif == Classification.EXCELLENT:
-        return max(0.0002 * prev_eval**2 + 0.1231 * prev_eval + 27.5455, 0)
-    elif classif == Classification.GOOD:
-        return max(0.0002 * prev_eval**2 + 0.2643 * prev_eval + 60.5455, 0)
-    elif classif == Classification.INACCURACY:
-        return max(0.0002 * prev_eval**2 + 0.3624 * prev_eval + 108.0909, 0)
-    elif classif == Classification.MISS:
-        return max(0.00025 * prev_eval**2 + 0.38255 * prev_eval + 166.9541, 0)
-    elif classif == Classification.MISTAKE:
-        return max(0.0003 * prev_eval**2 + 0.4027 * prev_eval + 225.8182, 0)
-    else:
-        return float("inf")
-
-def load_opening_book(csv_path):
-    opening_book = {}
+async def iter_position_infos(positions: List[chess.Board], moves: List[chess.Move], limits: List[Optional[chess.engine.Limit]], parallelism: int = None) -> AsyncIterator[Dict]:
+    # Yields the engine info of every position in order, as soon as it and all the
+    # positions before it are known. Positions found in the evaluation cache are
+    # served from there, the rest are spread over up to `parallelism` engines.
+    # Positions without a limit are derived from the position after their forced move.
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() if limit else None for limit in limits]
+    pending = collections.deque()
+    # Lookups may wait on the shared SQLite file, all of a game's are made at once off the event loop
+    cached = await run_blocking_io(lambda: [eval_cache.get(position, limit) if limit else None for position, limit in zip(positions, limits)])
+    for index, future in enumerate(futures):
+        if future is None:
+            continue
+        info = cached[index]
+        if info is None:
+            pending.append(index)
+        else:
+            future.set_result(info)
+
+    async def worker(engine, extra):
+        while pending:
+            if extra and engine_pool.has_waiters:
+                # Hand extra engines back as soon as another request is queueing for one
+                return
+            index = pending.popleft()
+            with engine_search_seconds.time():
+                info = await engine.analyse(positions[index], limits[index])
+            engine_searches.inc()
+            engine_search_nodes.inc(info.get("nodes", 0))
+            eval_cache.put(positions[index], limits[index], info)
+            futures[index].set_result(info)
+
+    async def extra_worker():
+        async with engine_pool.engine(wait=False) as engine:
+            if engine is not None:
+                await worker(engine, extra=True)
+
+    async def run_workers():
+        try:
+            async with engine_pool.engine() as engine:
+                try:
+                    async with asyncio.TaskGroup() as tasks:
+                        for _ in range(min(parallelism or REVIEW_MAX_PARALLELISM, engine_pool.size, len(pending)) - 1):
+                            tasks.create_task(extra_worker())
+                        await worker(engine, extra=False)
+                except BaseExceptionGroup as group:
+                    # Unwrapped, so the pool sees an engine error and checks the engine before reusing it
+                    raise group.exceptions[0] from None
+        except BaseException as error:
+            for future in futures:
+                if future is not None and not future.done():
+                    future.set_exception(error)
+            raise
+
+    runner = asyncio.create_task(run_workers()) if pending else None
     try:
-        with open(csv_path, newline='', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)
-            for row in reader:
-                if len(row) < 3:
-                    continue
-                pgn_moves = row[2]
-                game = chess.pgn.Game()
-                board = game.board()
-                for move in pgn_moves.split():
-                    if "." in move:
-                        continue
-                    try:
-                        chess_move = board.push_san(move)
-                        fen = " ".join(board.fen().split()[:4])
-                        opening_book[fen] = chess_move.uci()
-                    except ValueError:
-                        break
-    except Exception as e:
-        print(f"Error loading opening book: {e}")
-    return opening_book
-
-def is_book_move(board, opening_book, max_depth=8):  
-    if board.fullmove_number > max_depth:  
-        return None  
-    fen = " ".join(board.fen().split()[:4])
-    return opening_book.get(fen)
-
-
-engine_path = os.path.join(os.getcwd(), "models", "stockfish-windows-x86-64-avx2.exe")
-book_csv_path = os.path.join(os.getcwd(), "assets", "openings_master.csv")
-
-def analyze_pgn(pgn_file: str) -> Dict:
-    opening_book = load_opening_book(book_csv_path)
-    text_based_result = review_chess_game(pgn_file)
-    
-    with open(pgn_file) as pgn:
-        game = chess.pgn.read_game(pgn)
-    
+        index = 0
+        while index < len(positions):
+            searched = index
+            while futures[searched] is None:
+                searched += 1
+            infos = [await futures[searched]]
+            for forced in reversed(range(index, searched)):
+                infos.insert(0, forced_move_info(positions[forced], moves[forced], infos[0]))
+            for info in infos:
+                yield info
+            index = searched + 1
+    finally:
+        if runner is not None:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+            # The game's new evaluations are written in one transaction
+            await run_blocking_io(eval_cache.flush)
+        for future in futures:
+            # Errors nobody waited for have already been raised by the runner
+            if future is not None and future.done() and not future.cancelled():
+                future.exception()
+
+async def analyse_positions(positions: List[chess.Board], moves: List[chess.Move], limits: List[Optional[chess.engine.Limit]], parallelism: int = None) -> List[Dict]:
+    return [info async for info in iter_position_infos(positions, moves, limits, parallelism)]
+
+def convert_enums(obj):
+    if isinstance(obj, Enum):  # Convert Enum to its value
+        return obj.value
+    if isinstance(obj, dict):  # Recursively handle dicts
+        return {k: convert_enums(v) for k, v in obj.items()}
+    if isinstance(obj, list):  # Recursively handle lists
+        return [convert_enums(i) for i in obj]
+    return obj  # Return other types as they are
+
+# A game to review: PGN text, the path of a PGN file or an already parsed game
+ReviewSource = Union[str, os.PathLike, chess.pgn.Game]
+
+def read_text(path: str) -> str:
+    with open(path, encoding="utf-8", errors="replace") as text_file:
+        return text_file.read()
+
+def is_pgn_path(source: Union[str, os.PathLike]) -> bool:
+    # A single line naming an existing file is a path, anything else is PGN text
+    return isinstance(source, os.PathLike) or ("\n" not in source and os.path.isfile(source))
+
+def parse_game(pgn_text: str) -> Optional[chess.pgn.Game]:
+    return chess.pgn.read_game(io.StringIO(pgn_text))
+
+def load_game(source: ReviewSource) -> Tuple[Optional[chess.pgn.Game], Optional[str]]:
+    # (first game, PGN text sent to the text review) of any ReviewSource, the text is parsed only once
+    if isinstance(source, chess.pgn.Game):
+        return source, str(source)
+    pgn_text = read_text(source) if is_pgn_path(source) else source
+    return parse_game(pgn_text), pgn_text
+
+async def review_game(game: chess.pgn.Game, pgn_text: Optional[str], profile: str = DEFAULT_PROFILE, parallelism: int = None) -> AsyncIterator[Dict]:
+    # Yields {"type": "move", "data": ...} for every move as soon as it is classified,
+    # then {"type": "summary", "data": ...} with the remaining keys of the review.
+    # The text review is skipped when there is no pgn_text to send, otherwise it runs
+    # alongside the engine searches and only the summary waits for it.
+    started = time.perf_counter()
+    game_key = review_cache.game_key(game)
+    profile_key = f"{profile}:{ANALYSIS_PROFILES[profile]}"
+    engine_key = engine_pool.fingerprint()
+    cache_key = review_cache.key(game_key, profile_key, engine_key, with_text_review=pgn_text is not None)
+
+    cached = review_cache.get(cache_key) if review_cache.enabled else None
+    if cached is not None:
+        # Player summaries are keyed by name, the cached game may have had other headers
+        for move in cached["move_analysis"]:
+            yield {"type": "move", "data": move}
+        yield {"type": "summary", "data": {**cached["summary"], "player_summaries": player_summaries(game.headers, cached["move_analysis"])}}
+        stage_seconds.observe(time.perf_counter() - started, pipeline="review", stage="cached")
+        return
+
+    text_review_task = asyncio.create_task(text_review(pgn_text)) if pgn_text else None
+    evaluation_key = review_cache.evaluation_key(game_key, profile_key, engine_key)
+    evaluation = review_cache.get_evaluation(evaluation_key) if review_cache.enabled else None
+    moves = []
+    try:
+        if evaluation is not None:
+            # Evaluated before, by a review with or without the text review, only the classification is redone
+            with stage_timer("review", "classify"):
+                moves = classify(evaluation)
+            for move in moves:
+                yield {"type": "move", "data": move}
+        else:
+            positions = game_positions(game)
+            mainline_moves = list(game.mainline_moves())
+            evaluation = start_evaluation(game, positions, mainline_moves)
+            async with contextlib.aclosing(evaluate_positions(positions, mainline_moves, evaluation, profile, parallelism)) as analyses:
+                async for move in analyses:
+                    moves.append(move)
+                    yield {"type": "move", "data": move}
+            review_cache.put_evaluation(evaluation_key, game_key, profile_key, engine_key, evaluation)
+
+        summary = summarize(evaluation, moves, game.headers)
+        summary["test_based_review"] = await text_review_task if text_review_task is not None else None
+        if review_cache.enabled and not _has_error(summary["test_based_review"]):
+            # A failed or timed out text review is retried next time instead of being cached
+            review_cache.put(cache_key, game_key, profile_key, engine_key, {"move_analysis": moves, "summary": summary})
+        yield {"type": "summary", "data": summary}
+    finally:
+        if text_review_task is not None and not text_review_task.done():
+            text_review_task.cancel()
+    stage_seconds.observe(time.perf_counter() - started, pipeline="review", stage="total")
+
+def _has_error(text_review_result) -> bool:
+    return isinstance(text_review_result, dict) and "error" in text_review_result
+
+def start_evaluation(game: chess.pgn.Game, positions: List[chess.Board], mainline_moves: List[chess.Move]) -> Dict:
+    with stage_timer("review", "opening_book"):
+        book_moves = [is_book_move(board, opening_book) for board in positions[1:]]
+    forced_moves = [positions[ply].legal_moves.count() == 1 for ply in range(len(mainline_moves))]
+    return new_evaluation(positions, mainline_moves, book_moves, forced_moves, game.headers)
+
+async def evaluate_positions(positions: List[chess.Board], mainline_moves: List[chess.Move], evaluation: Dict, profile: str, parallelism: Optional[int]) -> AsyncIterator[Dict]:
+    # Fills in the engine results of the evaluation and yields the analysis of every
+    # move as soon as the positions before and after it are known.
+    # Every unique position of the mainline is searched at most once, the position
+    # after a move is also the position before the next one
+    limits = plan_searches(positions, evaluation["book"], evaluation["forced"], ANALYSIS_PROFILES[profile])
+
+    # Time spent waiting for engine results, the stage a slow review usually comes from
+    engine_wait = 0.0
+    async with contextlib.aclosing(iter_position_infos(positions, mainline_moves, limits, parallelism)) as position_infos:
+        for index in range(len(positions)):
+            waiting = time.perf_counter()
+            info = await anext(position_infos)
+            engine_wait += time.perf_counter() - waiting
+            add_position(evaluation, info)
+            if index > 0:
+                yield classify(evaluation, start=index - 1, stop=index)[0]
+
+    stage_seconds.observe(engine_wait, pipeline="review", stage="engine")
+
+def read_game(source: ReviewSource) -> Optional[chess.pgn.Game]:
+    return load_game(source)[0]
+
+async def collect_review(game: chess.pgn.Game, pgn_text: Optional[str], profile: str = DEFAULT_PROFILE, parallelism: int = None) -> Dict:
+    # Assembles the events of review_game into the /getReview document
+    result = {"move_analysis": []}
+    async with contextlib.aclosing(review_game(game, pgn_text, profile, parallelism)) as events:
+        async for event in events:
+            if event["type"] == "move":
+                result["move_analysis"].append(event["data"])
+            else:
+                result.update(event["data"])
+    return result
+
+async def analyze_pgn(source: ReviewSource, profile: str = DEFAULT_PROFILE) -> Dict:
+    # Paths are read off the event loop, text and parsed games are used as they are
+    if not isinstance(source, chess.pgn.Game) and is_pgn_path(source):
+        source = await run_blocking_io(read_text, source)
+    game, pgn_text = load_game(source)
     if not game:
         return {"error": "No game found in the PGN file."}
-    
-    result = {
-        "move_analysis": [],
-        "phase_analysis": {},
-        "player_summaries": {},
-        "test_based_review": text_based_result
-    }
-    
-    with chess.engine.SimpleEngine.popen_uci(engine_path) as engine:
-        board = game.board()
-        classifications = {
-            "white": {phase: [] for phase in GamePhase},
-            "black": {phase: [] for phase in GamePhase}
-        }
-        phase_data = {phase: [] for phase in GamePhase}
-        in_opening = True
-
-        for move_number, node in enumerate(game.mainline(), start=1):
-            # Analyze position before the move
-            pre_info = engine.analyse(board, chess.engine.Limit(time=0.3), multipv=3)[0]
-
-            pre_eval = pre_info["score"].white().score(mate_score=10000) or 0
-
-            pre_pv_moves = pre_info.get("pv", [])
-            
-            # Get best move and follow-up moves in UCI notation
-            best_move_pre = pre_pv_moves[0].uci() if pre_pv_moves else None
-            follow_up_pre = [m.uci() for m in pre_pv_moves[:min(len(pre_pv_moves), 5)]]
-
-            # Make the user move
-            move = node.move
-            board.push(move)  # Update the board state
-
-            # Analyze position after the move
-            post_info = engine.analyse(board, chess.engine.Limit(time=0.3), multipv=3)[0]
-
-            # Get best move and follow-up moves AFTER move is played (in UCI notation)
-            post_pv_moves = post_info.get("pv", [])
-            best_move_post = post_pv_moves[0].uci() if post_pv_moves else None
-            follow_up_post = [m.uci() for m in post_pv_moves[:min(len(post_pv_moves), 5)]]
-
-            post_eval = post_info["score"].white().score(mate_score=10000) or 0
-
-            # Determine game phase
-            book_move = is_book_move(board, opening_book)
-            current_phase = detect_game_phase(board, in_opening)
-            if not book_move and in_opening:
-                in_opening = False
-
-            # Calculate evaluation loss
-            eval_loss = abs(pre_eval - post_eval)
-
-            # Initial classification
-            classification = Classification.BOOK if book_move else None
-            if not classification:
-                for classif in centipawn_classifications:
-                    threshold = get_evaluation_loss_threshold(classif, pre_eval)
-                    if eval_loss <= threshold:
-                        classification = classif
-                        break
-                classification = classification or Classification.BLUNDER
-
-            # Check for missed opportunities
-            is_winning = abs(pre_eval) >= FORCED_WIN_THRESHOLD
-            is_forced_win = pre_info["score"].is_mate() and pre_info["score"].relative.mate() <= MISS_MATE_THRESHOLD
-            if is_winning and move != best_move_pre and (eval_loss >= MISS_CENTIPAWN_LOSS or is_forced_win):
-                classification = Classification.MISS
-
-            # Check for brilliant moves
-            if classification == Classification.BEST:
-                if pre_eval < -150 and post_eval >= 150:
-                    classification = Classification.GREAT
-                elif pre_eval < -300 and post_eval >= 300:
-                    classification = Classification.BRILLIANT
-
-            # Track classifications
-            player = "white" if board.turn == chess.BLACK else "black"
-            classifications[player][current_phase].append(classification)
-            phase_data[current_phase].append(classification)
-
-            # Add move analysis to result (using UCI notation)
-            result["move_analysis"].append({
-                "move_number": move_number,
-                "player": "White" if board.turn == chess.BLACK else "Black",
-                "user_move": move.uci(),
-                "evaluation": post_eval / 100,
-                "evaluation_loss": eval_loss / 100,
-                "classification": classification.value,
-                "best_move_pre": best_move_pre,  # Best move BEFORE move is played (UCI)
-                "follow_up_pre": follow_up_pre,  # Follow-up moves BEFORE move is played (UCI)
-                "best_move_post": best_move_post,  # Best move AFTER move is played (UCI)
-                "follow_up_post": follow_up_post  # Follow-up moves AFTER move is played (UCI)
-            })
-
-        # Phase analysis
-        for phase in GamePhase:
-            moves = phase_data[phase]
-            if moves:
-                rating = get_phase_rating(moves)
-                result["phase_analysis"][phase.value] = {
-                    "rating": rating.value,
-                    "move_count": len(moves)
-                }
-
-        # Player summaries
-        for color in ["white", "black"]:
-            player = game.headers["White" if color == "white" else "Black"]
-            counts = {c.value: 0 for c in Classification}
-            
-            for phase in GamePhase:
-                phase_moves = classifications[color][phase]
-                for m in phase_moves:
-                    m_enum = Classification(m) if isinstance(m, str) else m  # Convert if needed
-                    counts[m_enum.value] += 1
-            
-            result["player_summaries"][player] = counts
-
-    def convert_enums(obj):
-        if isinstance(obj, Enum):  # Convert Enum to its value
-            return obj.value
-        if isinstance(obj, dict):  # Recursively handle dicts
-            return {k: convert_enums(v) for k, v in obj.items()}
-        if isinstance(obj, list):  # Recursively handle lists
-            return [convert_enums(i) for i in obj]
-        return obj  # Return other types as they are
-
-    json_result = convert_enums(result)
-
-    return JSONResponse(content=json_result)
-
-
-def get_phase_rating(classified_moves: List[Classification]) -> Classification:
-
-    if not classified_moves:
-        return Classification.GOOD
-
-    classified_moves = [Classification(m) if isinstance(m, str) else m for m in classified_moves]
-        
-    total = sum(classification_values[m] for m in classified_moves)
-    average = total / len(classified_moves)
-    
-    rating_order = [
-        (Classification.BRILLIANT, 0.95),
-        (Classification.GREAT, 0.85),
-        (Classification.BEST, 0.75),
-        (Classification.EXCELLENT, 0.65),
-        (Classification.GOOD, 0.5),
-        (Classification.INACCURACY, 0.35),
-        (Classification.MISS, 0.25),
-        (Classification.MISTAKE, 0.15)
-    ]
-    
-    return next((c for c, t in rating_order if average >= t), Classification.BLUNDER)
\ No newline at end of file
+
+    result = await collect_review(game, pgn_text, profile)
+    return JSONResponse(content=result)
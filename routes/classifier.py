@@ -0,0 +1,352 @@
+"""Move classification over stored engine evaluations.
+
+A review is done in two stages. The engine stage (routes.chess_review) turns a
+game into an evaluation: per-ply arrays of moves, book and forced flags, phases,
+and per-position scores and principal variations. It is plain JSON and is kept
+in the review cache. The classification stage below is a pure function of an
+evaluation and a set of ClassificationRules, so stored games can be re-scored
+with other thresholds without running the engine again:
+
+    python -m routes.classifier --rules rules.json --output reclassified.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import chess
+import numpy as np
+
+
+class GamePhase(Enum):
+    OPENING = "opening"
+    MIDDLEGAME = "middlegame"
+    ENDGAME = "endgame"
+
+class Classification(Enum):
+    BRILLIANT = "brilliant"
+    GREAT = "great"
+    BEST = "best"
+    EXCELLENT = "excellent"
+    GOOD = "good"
+    INACCURACY = "inaccuracy"
+    MISTAKE = "mistake"
+    MISS = "miss"
+    BLUNDER = "blunder"
+    BOOK = "book"
+    FORCED = "forced"
+
+classification_values = {
+    Classification.BLUNDER: 0,
+    Classification.MISTAKE: 0.2,
+    Classification.MISS: 0.3,
+    Classification.INACCURACY: 0.4,
+    Classification.GOOD: 0.65,
+    Classification.EXCELLENT: 0.9,
+    Classification.BEST: 1,
+    Classification.GREAT: 1,
+    Classification.BRILLIANT: 1,
+    Classification.BOOK: 1,
+    Classification.FORCED: 1,
+}
+
+centipawn_classifications = [
+    Classification.BEST,
+    Classification.EXCELLENT,
+    Classification.GOOD,
+    Classification.INACCURACY,
+    Classification.MISS,
+    Classification.MISTAKE,
+    Classification.BLUNDER,
+]
+
+# Analysis parameters
+FORCED_WIN_THRESHOLD = 500
+MISS_CENTIPAWN_LOSS = 300
+MISS_MATE_THRESHOLD = 3
+ENDGAME_MATERIAL_THRESHOLD = 24
+QUEEN_VALUE = 9
+# Scores are in centipawns from White's side, a mate counts as this many
+MATE_SCORE = 10000
+# Moves of a principal variation kept per position
+PV_LENGTH = 5
+
+class ClassificationRules(NamedTuple):
+    # (a, b, c) per class: the largest evaluation loss it allows is max(a * e**2 + b * e + c, 0),
+    # e the absolute evaluation before the move. Classes are tried in this order, BLUNDER is the rest.
+    loss_thresholds: Tuple[Tuple[str, float, float, float], ...] = (
+        ("best", 0.0001, 0.0236, -3.7143),
+        ("excellent", 0.0002, 0.1231, 27.5455),
+        ("good", 0.0002, 0.2643, 60.5455),
+        ("inaccuracy", 0.0002, 0.3624, 108.0909),
+        ("miss", 0.00025, 0.38255, 166.9541),
+        ("mistake", 0.0003, 0.4027, 225.8182),
+    )
+    forced_win_threshold: float = FORCED_WIN_THRESHOLD
+    miss_centipawn_loss: float = MISS_CENTIPAWN_LOSS
+    miss_mate_threshold: int = MISS_MATE_THRESHOLD
+    # (below, at least): a best move from an evaluation below the first bound to one of at least the second
+    great: Tuple[float, float] = (-150, 150)
+    brilliant: Tuple[float, float] = (-300, 300)
+
+DEFAULT_RULES = ClassificationRules()
+
+def _number(name: str, value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{name} should be a number")
+    return float(value)
+
+def _numbers(name: str, values, count: int) -> Tuple[float, ...]:
+    if not isinstance(values, (list, tuple)) or len(values) != count:
+        raise ValueError(f"{name} takes {count} numbers")
+    return tuple(_number(name, value) for value in values)
+
+def rules_from_dict(overrides: Optional[Dict]) -> ClassificationRules:
+    # {"loss_thresholds": {"good": [a, b, c], ...}, "forced_win_threshold": 400, ...} on top of the defaults,
+    # raises ValueError for unknown or malformed rules
+    if not overrides:
+        return DEFAULT_RULES
+    if not isinstance(overrides, dict):
+        raise ValueError("Classification rules should be an object")
+    unknown = set(overrides) - set(ClassificationRules._fields)
+    if unknown:
+        raise ValueError(f"Unknown classification rules: {', '.join(sorted(unknown))}")
+    values = dict(overrides)
+    if "loss_thresholds" in values:
+        if not isinstance(values["loss_thresholds"], dict):
+            raise ValueError("loss_thresholds should map class names to three coefficients")
+        thresholds = {name: (a, b, c) for name, a, b, c in DEFAULT_RULES.loss_thresholds}
+        for name, coefficients in values["loss_thresholds"].items():
+            if name not in thresholds:
+                raise ValueError(f"No evaluation loss threshold for {name}")
+            thresholds[name] = _numbers(f"The threshold of {name}", coefficients, 3)
+        values["loss_thresholds"] = tuple((name, *coefficients) for name, coefficients in thresholds.items())
+    for name in ("forced_win_threshold", "miss_centipawn_loss", "miss_mate_threshold"):
+        if name in values:
+            values[name] = _number(name, values[name])
+    for name in ("great", "brilliant"):
+        if name in values:
+            values[name] = _numbers(name, values[name], 2)
+    return DEFAULT_RULES._replace(**values)
+
+def detect_game_phase(board: chess.Board, in_opening: bool) -> GamePhase:
+    if in_opening:
+        return GamePhase.OPENING
+
+    total_material = 0
+    queens = 0
+
+    for color in [chess.WHITE, chess.BLACK]:
+        for piece_type in chess.PIECE_TYPES:
+            if piece_type == chess.KING:
+                continue
+
+            count = len(board.pieces(piece_type, color))
+            value = {
+                chess.PAWN: 1,
+                chess.KNIGHT: 3,
+                chess.BISHOP: 3,
+                chess.ROOK: 5,
+                chess.QUEEN: QUEEN_VALUE
+            }[piece_type]
+
+            total_material += count * value
+            if piece_type == chess.QUEEN:
+                queens += count
+
+    endgame_conditions = [
+        total_material <= ENDGAME_MATERIAL_THRESHOLD,
+        queens == 0 and total_material <= ENDGAME_MATERIAL_THRESHOLD * 2,
+    ]
+
+    return GamePhase.ENDGAME if any(endgame_conditions) else GamePhase.MIDDLEGAME
+
+def get_evaluation_loss_threshold(classif: Classification, prev_eval: float, rules: ClassificationRules = DEFAULT_RULES) -> float:
+    prev_eval = abs(prev_eval)
+    for name, a, b, c in rules.loss_thresholds:
+        if name == classif.value:
+            return max(a * prev_eval**2 + b * prev_eval + c, 0)
+    return float("inf")
+
+def get_phase_rating(classified_moves: List[Classification]) -> Classification:
+
+    if not classified_moves:
+        return Classification.GOOD
+
+    classified_moves = [Classification(m) if isinstance(m, str) else m for m in classified_moves]
+
+    total = sum(classification_values[m] for m in classified_moves)
+    average = total / len(classified_moves)
+
+    rating_order = [
+        (Classification.BRILLIANT, 0.95),
+        (Classification.GREAT, 0.85),
+        (Classification.BEST, 0.75),
+        (Classification.EXCELLENT, 0.65),
+        (Classification.GOOD, 0.5),
+        (Classification.INACCURACY, 0.35),
+        (Classification.MISS, 0.25),
+        (Classification.MISTAKE, 0.15)
+    ]
+
+    return next((c for c, t in rating_order if average >= t), Classification.BLUNDER)
+
+def game_phases(positions: List[chess.Board], book_moves: List) -> List[str]:
+    # Phase of every ply, judged on the position after it
+    phases = []
+    in_opening = True
+    for ply, book_move in enumerate(book_moves):
+        # The first move out of book still counts as opening
+        phases.append(detect_game_phase(positions[ply + 1], in_opening).value)
+        in_opening = in_opening and bool(book_move)
+    return phases
+
+def new_evaluation(positions: List[chess.Board], moves: List[chess.Move], book_moves: List, forced_moves: List[bool], headers: Dict) -> Dict:
+    # Everything about the game that does not need the engine, the per-position lists are filled by add_position
+    return {
+        "headers": {"White": headers.get("White", "?"), "Black": headers.get("Black", "?")},
+        "moves": [move.uci() for move in moves],
+        "players": ["White" if board.turn == chess.WHITE else "Black" for board in positions[:-1]],
+        "book": [list(book_move) if book_move else None for book_move in book_moves],
+        "forced": list(forced_moves),
+        "phases": game_phases(positions, book_moves),
+        "evals": [],
+        "mates": [],
+        "pvs": [],
+    }
+
+def add_position(evaluation: Dict, info: Dict):
+    score = info["score"]
+    evaluation["evals"].append(score.white().score(mate_score=MATE_SCORE) or 0)
+    evaluation["mates"].append(score.relative.mate() if score.is_mate() else None)
+    evaluation["pvs"].append([move.uci() for move in info.get("pv", [])[:PV_LENGTH]])
+
+def evaluated_plies(evaluation: Dict) -> int:
+    return max(len(evaluation["evals"]) - 1, 0)
+
+def classify(evaluation: Dict, rules: ClassificationRules = DEFAULT_RULES, start: int = 0, stop: Optional[int] = None) -> List[Dict]:
+    # Move analyses of plies start to stop, every one needs the positions before and after it evaluated
+    stop = evaluated_plies(evaluation) if stop is None else stop
+    if stop <= start:
+        return []
+
+    evals = np.asarray(evaluation["evals"][start:stop + 1], dtype=np.float64)
+    pre, post = evals[:-1], evals[1:]
+    loss = np.abs(pre - post)
+    magnitude = np.abs(pre)
+
+    names = np.array([name for name, *_ in rules.loss_thresholds] + [Classification.BLUNDER.value], dtype=object)
+    a, b, c = (np.array([coefficients[i] for _, *coefficients in rules.loss_thresholds])[:, None] for i in range(3))
+    within = loss <= np.maximum(a * magnitude**2 + b * magnitude + c, 0)
+    classifications = names[np.where(within.any(axis=0), within.argmax(axis=0), len(names) - 1)]
+
+    forced = np.array(evaluation["forced"][start:stop], dtype=bool)
+    book = np.array([book_move is not None for book_move in evaluation["book"][start:stop]], dtype=bool)
+    classifications[forced] = Classification.FORCED.value
+    classifications[book] = Classification.BOOK.value
+
+    # Missed opportunities: a winning position and a large loss or a short mate let go
+    moves = evaluation["moves"][start:stop]
+    pvs = evaluation["pvs"][start:stop + 1]
+    best_moves = [pv[0] if pv else None for pv in pvs]
+    mates = np.array([np.nan if mate is None else mate for mate in evaluation["mates"][start:stop]], dtype=np.float64)
+    forced_win = mates <= rules.miss_mate_threshold
+    miss = (classifications != Classification.FORCED.value) & (magnitude >= rules.forced_win_threshold) & ((loss >= rules.miss_centipawn_loss) | forced_win)
+    classifications[miss] = Classification.MISS.value
+
+    best = classifications == Classification.BEST.value
+    great = best & (pre < rules.great[0]) & (post >= rules.great[1])
+    brilliant = best & ~great & (pre < rules.brilliant[0]) & (post >= rules.brilliant[1])
+    classifications[great] = Classification.GREAT.value
+    classifications[brilliant] = Classification.BRILLIANT.value
+
+    players = evaluation["players"]
+    return [{
+        "move_number": start + i + 1,
+        "player": players[start + i],
+        "user_move": moves[i],
+        "evaluation": float(post[i]) / 100,
+        "evaluation_loss": float(loss[i]) / 100,
+        "classification": classifications[i],
+        "best_move_pre": best_moves[i],  # Best move BEFORE move is played (UCI)
+        "follow_up_pre": pvs[i],  # Follow-up moves BEFORE move is played (UCI)
+        "best_move_post": best_moves[i + 1],  # Best move AFTER move is played (UCI)
+        "follow_up_post": pvs[i + 1],  # Follow-up moves AFTER move is played (UCI)
+    } for i in range(len(moves))]
+
+def player_summaries(headers: Dict, move_analysis: List[Dict]) -> Dict:
+    # Classification counts per player, keyed by the names in the headers
+    names = [c.value for c in Classification]
+    index = {name: i for i, name in enumerate(names)}
+    players = np.array([move["player"] == "White" for move in move_analysis], dtype=bool)
+    codes = np.array([index[move["classification"]] for move in move_analysis], dtype=np.int64)
+    summaries = {}
+    for color, mask in (("White", players), ("Black", ~players)):
+        counts = np.bincount(codes[mask], minlength=len(names))
+        summaries[headers[color]] = dict(zip(names, counts.tolist()))
+    return summaries
+
+def summarize(evaluation: Dict, move_analysis: List[Dict], headers: Optional[Dict] = None) -> Dict:
+    # The summary keys of a review, without the text review
+    phases = evaluation["phases"][:len(move_analysis)]
+    phase_analysis = {}
+    for phase in GamePhase:
+        moves = [move["classification"] for move, move_phase in zip(move_analysis, phases) if move_phase == phase.value]
+        if moves:
+            phase_analysis[phase.value] = {
+                "rating": get_phase_rating(moves).value,
+                "move_count": len(moves)
+            }
+
+    book = [book_move for book_move in evaluation["book"][:len(move_analysis)] if book_move]
+    return {
+        "phase_analysis": phase_analysis,
+        "player_summaries": player_summaries(headers or evaluation["headers"], move_analysis),
+        "opening": {"eco": book[-1][0], "name": book[-1][1]} if book else None,
+    }
+
+def reclassify(evaluation: Dict, rules: ClassificationRules = DEFAULT_RULES, headers: Optional[Dict] = None) -> Dict:
+    move_analysis = classify(evaluation, rules)
+    return {"move_analysis": move_analysis, **summarize(evaluation, move_analysis, headers)}
+
+
+def main():
+    from routes.review_cache import review_cache
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", help="JSON file with the rules that differ from the defaults")
+    parser.add_argument("--output", help="write one reclassified review per line to this file")
+    args = parser.parse_args()
+
+    rules = DEFAULT_RULES
+    if args.rules:
+        with open(args.rules) as rules_file:
+            rules = rules_from_dict(json.load(rules_file))
+    if not review_cache.enabled:
+        sys.exit("The review cache is disabled, there are no stored evaluations")
+
+    output = open(args.output, "w") if args.output else None
+    totals = {c.value: 0 for c in Classification}
+    games = 0
+    elapsed = 0.0
+    try:
+        for game_key, profile, evaluation in review_cache.evaluations():
+            start = time.perf_counter()
+            review = reclassify(evaluation, rules)
+            elapsed += time.perf_counter() - start
+            games += 1
+            for move in review["move_analysis"]:
+                totals[move["classification"]] += 1
+            if output is not None:
+                output.write(json.dumps({"game": game_key, "profile": profile, **review}) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+
+    print(f"Reclassified {games} games in {elapsed * 1000:.1f}ms", file=sys.stderr)
+    print(json.dumps(totals, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,16 @@
-from ultralytics import YOLO
-from PIL import Image
+import numpy as np
 import os 
+from routes.inference_batcher import MicroBatcher, INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT_MS
+from routes.model_backend import LazyModel
 
 curr = os.getcwd()
 detect_model_path = os.path.join(curr, 'models', 'chessDetection3d.pt')
-detect_model = YOLO(detect_model_path)
-
-async def detect_pieces(image : Image):
-    if image is None:
-        print("No image is there")
-        return {"error" : "No image detected"}
-    
-    results = detect_model.predict(image)
+# Loaded on the first prediction, or at startup when PRELOAD_MODELS is set
+detect_model = LazyModel(detect_model_path)
+# Concurrent requests share one batched predict call
+detect_batcher = MicroBatcher(lambda images: detect_model.get().predict(images), INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT_MS)
 
+def parse_detections(results, names):
     if not results or len(results) == 0:
         print("No results are there")
         return {"error" : "No results found"}
@@ -24,10 +22,19 @@ async def detect_pieces(image : Image):
     class_names = []
 
     for idx in classes:
-        class_names.append(detect_model.names[idx])
+        class_names.append(names[idx])
 
     return {
         "boxes": boxes,
         "confidences": confidences,
         "classes": class_names
     }
+
+async def detect_pieces(image : np.ndarray):
+    if image is None:
+        print("No image is there")
+        return {"error" : "No image detected"}
+    
+    results = [await detect_batcher.submit(image)]
+
+    return parse_detections(results, detect_model.get().names)
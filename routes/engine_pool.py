@@ -0,0 +1,244 @@
+import asyncio
+import collections
+import contextlib
+import os
+import chess.engine
+from routes.metrics import engine_checkout_seconds
+
+
+engine_path = os.getenv("STOCKFISH_PATH", os.path.join(os.getcwd(), "models", "stockfish-windows-x86-64-avx2.exe"))
+
+
+class EnginePoolTimeout(Exception):
+    """Raised when no engine could be checked out before the timeout expired."""
+
+
+class EnginePool:
+    """A fixed-size pool of persistent UCI engine processes.
+
+    Engines are started lazily up to ``size`` and handed out first come, first
+    served. Callers that cannot get an engine within ``checkout_timeout``
+    seconds get an ``EnginePoolTimeout`` instead of a new process. Once
+    ``prestart`` has run, engines that crash or fail to start are replaced in
+    the background, retrying after ``restart_backoff`` seconds and doubling
+    that up to ``max_restart_backoff``.
+    """
+
+    def __init__(self, path, size=2, threads=1, hash_mb=64, checkout_timeout=30.0, health_timeout=5.0,
+                 restart_backoff=1.0, max_restart_backoff=60.0):
+        self.path = path
+        self.size = size
+        self.options = {"Threads": threads, "Hash": hash_mb}
+        self.checkout_timeout = checkout_timeout
+        self.health_timeout = health_timeout
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        # Engines kept running without waiting for a checkout, set by prestart
+        self.min_running = 0
+
+        self._idle = collections.deque()
+        self._waiters = collections.deque()
+        self._created = 0
+        self._closed = False
+        self._refill_task = None
+        self.error = None
+
+    @property
+    def in_use(self):
+        return self._created - len(self._idle)
+
+    @property
+    def has_waiters(self):
+        return bool(self._waiters)
+
+    def fingerprint(self) -> str:
+        # Identifies the engine build from its files without starting it
+        command = self.path if isinstance(self.path, (list, tuple)) else [self.path]
+        parts = []
+        for part in command:
+            try:
+                stat = os.stat(part)
+                parts.append(f"{os.path.basename(part)}:{stat.st_size}:{int(stat.st_mtime)}")
+            except OSError:
+                parts.append(str(part))
+        return " ".join(parts)
+
+    async def _spawn(self, reserved=False):
+        if not reserved:
+            self._created += 1
+        try:
+            transport, engine = await chess.engine.popen_uci(self.path)
+        except BaseException:
+            self._created -= 1
+            raise
+        try:
+            options = {name: value for name, value in self.options.items() if name in engine.options}
+            await engine.configure(options)
+        except BaseException:
+            # Also on cancellation, a started process must not outlive the failed checkout
+            self._created -= 1
+            transport.close()
+            raise
+        self.error = None
+        engine.returncode.add_done_callback(lambda _: self._exited(engine))
+        return engine
+
+    def _exited(self, engine):
+        # Engines that die in use are discarded on release, idle ones are dropped here
+        if engine in self._idle:
+            self._idle.remove(engine)
+            self._created -= 1
+            self._refill()
+
+    def _refill(self):
+        # Replaces crashed engines in the background, a pool nobody checks out from would otherwise stay empty
+        if self._closed or self._created >= self.min_running:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.get_running_loop().create_task(self._run_refill())
+
+    async def _run_refill(self):
+        backoff = self.restart_backoff
+        while not self._closed and self._created < self.min_running:
+            try:
+                engine = await self._spawn()
+            except Exception as e:
+                self.error = str(e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_restart_backoff)
+                continue
+            backoff = self.restart_backoff
+            await self.release(engine)
+
+    async def _discard(self, engine):
+        self._created -= 1
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(engine.quit(), self.health_timeout)
+        self._refill()
+
+    async def _is_healthy(self, engine):
+        if engine.returncode.done():
+            return False
+        try:
+            await asyncio.wait_for(engine.ping(), self.health_timeout)
+            return True
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            return False
+
+    async def acquire(self, timeout=None, wait=True):
+        if self._closed:
+            raise RuntimeError("Engine pool is closed")
+
+        while self._idle and not self._waiters:
+            engine = self._idle.popleft()
+            if not engine.returncode.done():
+                return engine
+            # The process died while idle, drop it and try the next one
+            await self._discard(engine)
+
+        if self._created < self.size and not self._waiters:
+            return await self._spawn()
+        if not wait:
+            return None
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        timeout = self.checkout_timeout if timeout is None else timeout
+        try:
+            engine = await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            raise EnginePoolTimeout(f"No engine available after {timeout}s") from None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        if engine is None:
+            # A crashed engine was released, its slot is reserved for us
+            return await self._spawn(reserved=True)
+        return engine
+
+    async def release(self, engine, check=False):
+        if self._closed:
+            await self._discard(engine)
+            return
+        # A dead process is never handed on, even by callers that saw no error
+        if engine.returncode.done() or check and not await self._is_healthy(engine):
+            await self._discard(engine)
+            engine = None
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                if engine is None:
+                    # Reserve the freed slot so the waiter can spawn a replacement
+                    self._created += 1
+                waiter.set_result(engine)
+                return
+
+        if engine is not None:
+            self._idle.append(engine)
+
+    @contextlib.asynccontextmanager
+    async def engine(self, timeout=None, wait=True):
+        # With wait=False this yields None instead of queueing when the pool is busy
+        with engine_checkout_seconds.time():
+            engine = await self.acquire(timeout, wait)
+        if engine is None:
+            yield None
+            return
+        failed = False
+        try:
+            yield engine
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            failed = True
+            raise
+        except asyncio.CancelledError:
+            # The engine may still be searching for the cancelled caller
+            failed = True
+            raise
+        finally:
+            await self.release(engine, check=failed)
+
+    async def prestart(self, count=1):
+        # Starts engines ahead of the first review and keeps that many running, failures are
+        # kept for the readiness check until a start succeeds
+        self.min_running = min(count, self.size)
+        self._refill()
+        if self._refill_task is not None:
+            await self._refill_task
+
+    @property
+    def ready(self):
+        return self._created > 0 and self.error is None
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "size": self.size,
+            "running": self._created,
+            "in_use": self.in_use,
+            "waiting": len(self._waiters),
+            "error": self.error,
+        }
+
+    async def close(self):
+        self._closed = True
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            await asyncio.gather(self._refill_task, return_exceptions=True)
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.cancel()
+        self._waiters.clear()
+        while self._idle:
+            await self._discard(self._idle.popleft())
+
+
+engine_pool = EnginePool(
+    engine_path,
+    size=int(os.getenv("ENGINE_POOL_SIZE", "2")),
+    threads=int(os.getenv("ENGINE_THREADS", "1")),
+    hash_mb=int(os.getenv("ENGINE_HASH_MB", "64")),
+    checkout_timeout=float(os.getenv("ENGINE_CHECKOUT_TIMEOUT", "30")),
+    restart_backoff=float(os.getenv("ENGINE_RESTART_BACKOFF", "1")),
+)
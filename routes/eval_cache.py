@@ -0,0 +1,221 @@
+import collections
+import os
+import sqlite3
+import threading
+from typing import Dict, NamedTuple, Optional
+import chess
+import chess.engine
+import chess.polyglot
+
+
+# Connections inherited over a fork, referenced so they are never closed (and finalized) in the child
+_inherited = []
+
+
+class CachedEval(NamedTuple):
+    mate: bool
+    score: int  # centipawns or moves to mate, relative to the side to move
+    pv: str  # space separated UCI moves
+    depth: int
+    nodes: int
+    time: float
+
+
+# Lookups that would wait longer than this for another process's write count as misses
+EVAL_CACHE_BUSY_TIMEOUT = float(os.getenv("EVAL_CACHE_BUSY_TIMEOUT", "0.1"))
+
+
+def _signed(key: int) -> int:
+    # SQLite integers are signed 64 bit, Zobrist hashes are unsigned
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def _is_strong_enough(entry: CachedEval, limit: chess.engine.Limit) -> bool:
+    if limit.depth is not None and entry.depth < limit.depth:
+        return False
+    if limit.nodes is not None and entry.nodes < limit.nodes:
+        return False
+    if limit.time is not None and entry.time < limit.time:
+        return False
+    return True
+
+
+class EvalCache:
+    """Two tier cache of engine evaluations keyed by the Zobrist hash of the position.
+
+    Lookups go to an in-process LRU first and then to an SQLite file shared by
+    all workers. An entry is only served when it was searched at least as deep,
+    as long or with as many nodes as the requested limit. Stores go to the LRU
+    at once and to the file on the next ``flush``, which callers on the event
+    loop run in the blocking I/O threads, like lookups that may reach the file.
+    """
+
+    def __init__(self, path: Optional[str], memory_size: int = 100_000, busy_timeout: float = EVAL_CACHE_BUSY_TIMEOUT):
+        self.path = path
+        self.memory_size = memory_size
+        self.busy_timeout = busy_timeout
+        self._memory = collections.OrderedDict()
+        # Rows stored since the last flush
+        self._pending = []
+        self._lock = threading.Lock()
+        # The connection has its own lock, a slow query must not hold up the LRU
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._disk_entries = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "busy": 0}
+
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._connect()
+            except (OSError, sqlite3.Error) as e:
+                # The cache is optional, an unwritable directory must not keep the API from starting
+                print(f"Evaluation cache disabled, keeping evaluations in memory only: {e}")
+                self._db = None
+
+    def _connect(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS evals ("
+            "key INTEGER PRIMARY KEY, mate INTEGER, score INTEGER, pv TEXT, "
+            "depth INTEGER, nodes INTEGER, time REAL)"
+        )
+        self._db.commit()
+        # Set after the schema, which may wait for other workers as long as sqlite's default
+        self._db.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+
+    def reopen(self):
+        # An SQLite connection must not be used on both sides of a fork, the child opens its own
+        # and leaves the inherited one alone, closing it could release the parent's locks
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        if self._db is not None:
+            _inherited.append(self._db)
+            self._connect()
+
+    def _remember(self, key: int, entry: CachedEval):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, board: chess.Board, limit: chess.engine.Limit) -> Optional[Dict]:
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and _is_strong_enough(entry, limit):
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._to_info(board, entry)
+
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    row = self._db.execute(
+                        "SELECT mate, score, pv, depth, nodes, time FROM evals WHERE key = ?", (_signed(key),)
+                    ).fetchone()
+            except sqlite3.OperationalError:
+                # Locked by another worker for longer than the busy timeout, searching is cheaper than waiting
+                row = None
+                self.counters["busy"] += 1
+            if row is not None:
+                entry = CachedEval(bool(row[0]), *row[1:])
+                if _is_strong_enough(entry, limit):
+                    with self._lock:
+                        self._remember(key, entry)
+                        self.counters["disk_hits"] += 1
+                    return self._to_info(board, entry)
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, board: chess.Board, limit: chess.engine.Limit, info: Dict):
+        # Only memory, the row is written by the next flush
+        score = info.get("score")
+        if score is None:
+            return
+        relative = score.relative
+        entry = CachedEval(
+            mate=relative.is_mate(),
+            score=relative.mate() if relative.is_mate() else relative.score(),
+            pv=" ".join(move.uci() for move in info.get("pv", [])),
+            depth=info.get("depth") or limit.depth or 0,
+            nodes=info.get("nodes") or limit.nodes or 0,
+            # The reported time can be a hair below the requested limit
+            time=max(info.get("time") or 0.0, limit.time or 0.0),
+        )
+        key = chess.polyglot.zobrist_hash(board)
+        with self._lock:
+            current = self._memory.get(key)
+            if current is None or entry.depth >= current.depth:
+                self._remember(key, entry)
+            if self._db is not None:
+                self._pending.append((_signed(key), int(entry.mate), entry.score, entry.pv, entry.depth, entry.nodes, entry.time))
+            self.counters["stores"] += 1
+
+    def flush(self):
+        # Writes the stored rows in one transaction, blocking, so async callers use run_blocking_io
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows or self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT INTO evals (key, mate, score, pv, depth, nodes, time) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET mate = excluded.mate, score = excluded.score, pv = excluded.pv, "
+                    "depth = excluded.depth, nodes = excluded.nodes, time = excluded.time "
+                    "WHERE excluded.depth >= evals.depth",
+                    rows,
+                )
+                self._db.commit()
+        except sqlite3.OperationalError:
+            # Still busy, the rows stay in memory and are written with the next flush
+            with self._db_lock:
+                self._db.rollback()
+            with self._lock:
+                # Bounded like the LRU, the oldest rows are given up first
+                self._pending[:0] = rows
+                del self._pending[:-self.memory_size or None]
+                self.counters["busy"] += 1
+
+    @staticmethod
+    def _to_info(board: chess.Board, entry: CachedEval) -> Dict:
+        relative = chess.engine.Mate(entry.score) if entry.mate else chess.engine.Cp(entry.score)
+        return {
+            "score": chess.engine.PovScore(relative, board.turn),
+            "pv": [chess.Move.from_uci(move) for move in entry.pv.split()],
+            "depth": entry.depth,
+            "nodes": entry.nodes,
+            "time": entry.time,
+        }
+
+    def stats(self) -> Dict:
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    self._disk_entries = self._db.execute("SELECT COUNT(*) FROM evals").fetchone()[0]
+            except sqlite3.OperationalError:
+                # Busy, the last count is reported again
+                pass
+        with self._lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._disk_entries,
+                "pending_writes": len(self._pending),
+            }
+
+
+eval_cache = EvalCache(
+    os.getenv("EVAL_CACHE_PATH", os.path.join(os.getcwd(), "cache", "eval_cache.sqlite3")) or None,
+    memory_size=int(os.getenv("EVAL_CACHE_MEMORY_SIZE", "100000")),
+)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=eval_cache.reopen)
@@ -0,0 +1,69 @@
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+from routes.metrics import http_requests_in_flight, http_requests_rejected
+
+
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", str(max(2, (os.cpu_count() or 2) // 2))))
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", "8"))
+
+# CPU heavy work (model inference, image decoding) and blocking network calls get
+# separate pools so a slow upstream API can never hold up inference threads
+inference_executor = concurrent.futures.ThreadPoolExecutor(INFERENCE_THREADS, thread_name_prefix="inference")
+blocking_io_executor = concurrent.futures.ThreadPoolExecutor(BLOCKING_IO_THREADS, thread_name_prefix="blocking-io")
+
+
+async def run_inference(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_blocking_io(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_io_executor, functools.partial(func, *args, **kwargs))
+
+
+class ConcurrencyLimitMiddleware:
+    """ASGI middleware capping in-flight requests per path.
+
+    ``limits`` maps a path to the number of requests allowed at once. Requests
+    over the limit are answered right away with 503 and a Retry-After header.
+    A slot is held until the response body is fully sent, so streamed responses
+    count for their whole duration.
+    """
+
+    def __init__(self, app, limits, retry_after=5):
+        self.app = app
+        self.limits = limits
+        self.retry_after = retry_after
+        self.in_flight = {path: 0 for path in limits}
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path") if scope["type"] == "http" else None
+        if path not in self.limits:
+            return await self.app(scope, receive, send)
+
+        if self.in_flight[path] >= self.limits[path]:
+            http_requests_rejected.inc(path=path)
+            body = json.dumps({"error": "Server is busy, try again later"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        self.in_flight[path] += 1
+        http_requests_in_flight.inc(path=path)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[path] -= 1
+            http_requests_in_flight.dec(path=path)
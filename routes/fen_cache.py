@@ -0,0 +1,92 @@
+import asyncio
+import collections
+import hashlib
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class FenCache:
+    """Bounded LRU of /getFen results with a TTL and single-flight deduplication.
+
+    Concurrent requests for the same key share one computation; it runs as its
+    own task so a caller going away does not cancel it for the others.
+    ``cacheable`` decides which results are kept once computed.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, mode: str = "exact"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.mode = mode
+        self._entries = collections.OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    @property
+    def enabled(self):
+        return self.mode != "off" and self.max_entries > 0
+
+    @staticmethod
+    def exact_key(image_content: bytes, perspective: str, next_to_move: str) -> Hashable:
+        return ("sha256", hashlib.sha256(image_content).hexdigest(), perspective, next_to_move)
+
+    @staticmethod
+    def perceptual_key(image_hash: int, perspective: str, next_to_move: str) -> Hashable:
+        return ("dhash", image_hash, perspective, next_to_move)
+
+    def get(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]], cacheable: Callable[[Any], bool] = lambda value: True):
+        value = self.get(key)
+        if value is not None:
+            self.counters["hits"] += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            self.counters["misses"] += 1
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+
+            def done(finished: asyncio.Task):
+                self._in_flight.pop(key, None)
+                if not finished.cancelled() and finished.exception() is None and cacheable(finished.result()):
+                    self.put(key, finished.result())
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+        return {
+            **self.counters,
+            "mode": self.mode,
+            "hit_rate": (self.counters["hits"] + self.counters["coalesced"]) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+        }
+
+
+# FEN_CACHE_MODE: exact (hash of the upload bytes), phash (perceptual hash of the decoded image) or off
+fen_cache = FenCache(
+    max_entries=int(os.getenv("FEN_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("FEN_CACHE_TTL", "3600")),
+    mode=os.getenv("FEN_CACHE_MODE", "exact"),
+)
@@ -1,4 +1,5 @@
 import json
+import numpy as np
 
 FEN_MAPPING = {
     "black-pawn": "p", "black-rook": "r", "black-knight": "n", "black-bishop": "b", "black-queen": "q", "black-king": "k",
@@ -41,77 +42,137 @@ def get_grid_coordinate(pixel_x, pixel_y, perspective):
         print(f"Error in get_grid_coordinate: {e}")
         return None  
 
-def gen_fen(result: dict, p: str, next_to_move : str):
+def _clean_detections(result):
+    # Returns (boxes, pieces, confidences) for the usable detections of one result, None if unusable
+    if not isinstance(result, dict):
+        print("Error: Expected a dictionary for result")
+        return None
+
+    boxes = result.get("boxes", [])
+    classes = result.get("classes", [])
+    confidences = result.get("confidences") or [1.0] * len(boxes)
+
+    if not boxes or not classes:
+        print("Error: Missing 'boxes' or 'classes' in input")
+        return None
+
+    if len(boxes) != len(classes) or len(boxes) != len(confidences):
+        print("Error: Mismatch between bounding boxes, class labels and confidences")
+        return None
+
+    clean_boxes, pieces, clean_confidences = [], [], []
+    for box, class_name, confidence in zip(boxes, classes, confidences):
+        if not isinstance(box, (list, tuple)) or len(box) != 4:
+            print(f"Skipping invalid box: {box}")
+            continue
+
+        fen_piece = FEN_MAPPING.get(class_name, None)
+        if not fen_piece:
+            print(f"Skipping unrecognized piece: {class_name}")
+            continue
+
+        try:
+            clean_boxes.append([int(v) for v in box])
+        except (ValueError, TypeError, OverflowError):
+            print(f"Skipping box with invalid values: {box}")
+            continue
+        pieces.append(fen_piece)
+        clean_confidences.append(float(confidence))
+
+    return clean_boxes, pieces, clean_confidences
+
+def assign_squares(results: list, p: str):
+    """Maps the detections of a batch of results onto 8x8 boards in one pass.
+
+    Returns a (batch, 8, 8) array of FEN piece letters ("" for empty squares)
+    and a matching array of confidences (NaN for empty squares), rows ordered
+    as in the FEN. When several boxes land on one square the most confident
+    one wins, ties go to the later box. Unusable results get an all-empty board.
+    """
+    pieces = np.full((len(results), 8, 8), "", dtype="<U1")
+    confidence = np.full((len(results), 8, 8), np.nan)
+
+    cleaned = [_clean_detections(result) for result in results]
+    batch_index, boxes, piece_letters, box_confidence = [], [], [], []
+    for index, detections in enumerate(cleaned):
+        if detections is None:
+            continue
+        batch_index += [index] * len(detections[0])
+        boxes += detections[0]
+        piece_letters += detections[1]
+        box_confidence += detections[2]
+    if not boxes:
+        return pieces, confidence, [detections is not None for detections in cleaned]
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    batch_index = np.asarray(batch_index)
+    piece_letters = np.asarray(piece_letters)
+    box_confidence = np.asarray(box_confidence)
+
+    # Box centers in pixels, y measured from the bottom of the board image
+    pixel_x = np.trunc((boxes[:, 0] + boxes[:, 2]) / 2) - border
+    pixel_y = np.trunc(grid_size - (boxes[:, 1] + boxes[:, 3]) / 2) - border
+    inside = (pixel_x >= 0) & (pixel_y >= 0) & (pixel_x < grid_size) & (pixel_y < grid_size)
+
+    x_index = (pixel_x[inside] // block_size).astype(int)
+    y_index = (pixel_y[inside] // block_size).astype(int)
+    if p == "b":
+        x_index = 7 - x_index
+        y_index = 7 - y_index
+    row, col = 7 - y_index, x_index
+    batch_index, piece_letters, box_confidence = batch_index[inside], piece_letters[inside], box_confidence[inside]
+
+    # Sort by square, then confidence, then input order; the last box of every square wins
+    square = (batch_index * 8 + row) * 8 + col
+    order = np.lexsort((np.arange(len(square)), box_confidence, square))
+    last_of_square = np.ones(len(order), dtype=bool)
+    last_of_square[:-1] = square[order][1:] != square[order][:-1]
+    winners = order[last_of_square]
+
+    pieces[batch_index[winners], row[winners], col[winners]] = piece_letters[winners]
+    confidence[batch_index[winners], row[winners], col[winners]] = box_confidence[winners]
+    return pieces, confidence, [detections is not None for detections in cleaned]
+
+def board_to_fen(board, next_to_move: str) -> str:
+    fen_rows = []
+    for row in board:
+        fen_row = ""
+        empty_count = 0
+        for cell in row:
+            if not cell:
+                empty_count += 1
+            else:
+                if empty_count > 0:
+                    fen_row += str(empty_count)
+                    empty_count = 0
+                fen_row += cell
+        if empty_count > 0:
+            fen_row += str(empty_count)
+        fen_rows.append(fen_row)
+
+    position_fen = "/".join(fen_rows)
+    return f"{position_fen} {next_to_move} - - 0 0"
+
+def gen_fen_batch(results: list, p: str, next_to_move : str):
+    # One (fen, square_confidence) pair per detection result, (None, None) for unusable ones.
+    # square_confidence follows the FEN row order and is None for empty squares.
     try:
-        if not isinstance(result, dict):
-            print("Error: Expected a dictionary for result")
-            return None
-
-        boxes = result.get("boxes", [])
-        classes = result.get("classes", [])
-
-        if not boxes or not classes:
-            print("Error: Missing 'boxes' or 'classes' in input")
-            return None
-
-        if len(boxes) != len(classes):
-            print("Error: Mismatch between bounding boxes and class labels")
-            return None
-
-        height, width = 224, 224  
-        board = [["8"] * 8 for _ in range(8)]  
-
-        for box, class_name in zip(boxes, classes):
-            if not isinstance(box, (list, tuple)) or len(box) != 4:
-                print(f"Skipping invalid box: {box}")
-                continue  
-
-            fen_piece = FEN_MAPPING.get(class_name, None)
-            if not fen_piece:
-                print(f"Skipping unrecognized piece: {class_name}")
-                continue  
-
-            try:
-                x_min, y_min, x_max, y_max = map(int, box)
-            except ValueError:
-                print(f"Skipping box with invalid values: {box}")
-                continue  
-
-            center_x, center_y = (x_min + x_max) / 2, (y_min + y_max) / 2
-            pixel_x = int(center_x)
-            pixel_y = int(height - center_y)  
-
-            grid_position = get_grid_coordinate(pixel_x, pixel_y, p)
-            if grid_position:
-                file = ord(grid_position[0]) - ord('a')
-                rank = int(grid_position[1]) - 1
-
-                if 0 <= rank < 8 and 0 <= file < 8:
-                    board[rank][file] = fen_piece
-                else:
-                    print(f"Skipping out-of-bounds grid position: {grid_position}")
-
-        fen_rows = []
-        for row in board:
-            fen_row = ""
-            empty_count = 0
-            for cell in row:
-                if cell == "8":
-                    empty_count += 1
-                else:
-                    if empty_count > 0:
-                        fen_row += str(empty_count)
-                        empty_count = 0
-                    fen_row += cell
-            if empty_count > 0:
-                fen_row += str(empty_count)
-            fen_rows.append(fen_row)  # FIXED: Ensured last row is added
-
-        position_fen = "/".join(fen_rows)
-        fen_notation = f"{position_fen} {next_to_move} - - 0 0"
-
-        return fen_notation
+        pieces, confidence, usable = assign_squares(results, p)
+        output = []
+        for board, board_confidence, ok in zip(pieces, confidence, usable):
+            if not ok:
+                output.append((None, None))
+                continue
+            square_confidence = [[None if np.isnan(c) else round(float(c), 4) for c in row] for row in board_confidence]
+            output.append((board_to_fen(board, next_to_move), square_confidence))
+        return output
 
     except Exception as e:
         print(f"Error in gen_fen: {e}")
-        return None  
+        return [(None, None)] * len(results)
+
+def gen_fen_with_confidence(result: dict, p: str, next_to_move : str):
+    return gen_fen_batch([result], p, next_to_move)[0]
+
+def gen_fen(result: dict, p: str, next_to_move : str):
+    return gen_fen_with_confidence(result, p, next_to_move)[0]
@@ -0,0 +1,81 @@
+import collections
+import contextlib
+import io
+import os
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# Longest side the segmentation pass needs, larger uploads are decoded at reduced resolution
+MAX_DECODE_SIDE = int(os.getenv("MAX_DECODE_SIDE", "1280"))
+BOARD_SIZE = 224
+
+
+def decode_image(image_content: bytes, max_side: int = MAX_DECODE_SIDE) -> np.ndarray:
+    # Returns a contiguous BGR array, the layout the YOLO models take without conversion
+    image = Image.open(io.BytesIO(image_content))
+    width, height = image.size
+    if image.format == "JPEG" and max(width, height) > max_side:
+        # libjpeg scales by 1/2, 1/4 or 1/8 while decoding, never below the requested size
+        scale = max(width, height) / max_side
+        image.draft("RGB", (int(width / scale), int(height / scale)))
+    image.load()
+
+    # Before reducing, Image.reduce does not support palette, bilevel or 16 bit modes
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    factor = max(image.size) // max_side
+    if factor > 1:
+        image = image.reduce(factor)
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+
+def crop_view(frame: np.ndarray, x_min: int, y_min: int, x_max: int, y_max: int) -> np.ndarray:
+    # A view into the decoded frame, no pixels are copied
+    height, width = frame.shape[:2]
+    x_min, x_max = max(0, x_min), min(width, x_max)
+    y_min, y_max = max(0, y_min), min(height, y_max)
+    return frame[y_min:y_max, x_min:x_max]
+
+
+def resize_into(board: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # The single resize of the pipeline, written straight into a pooled buffer
+    cv2.resize(board, (out.shape[1], out.shape[0]), dst=out, interpolation=cv2.INTER_AREA)
+    return out
+
+
+def dhash(frame: np.ndarray) -> int:
+    # 64 bit difference hash, stable under re-encoding and small rescales of the same image
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class BufferPool:
+    """Reusable arrays of one shape so every request does not allocate its own."""
+
+    def __init__(self, shape, dtype=np.uint8, max_buffers: int = 32):
+        self.shape = shape
+        self.dtype = dtype
+        self.max_buffers = max_buffers
+        self._free = collections.deque()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def borrow(self):
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+        if buffer is None:
+            buffer = np.empty(self.shape, dtype=self.dtype)
+        try:
+            yield buffer
+        finally:
+            with self._lock:
+                if len(self._free) < self.max_buffers:
+                    self._free.append(buffer)
+
+
+board_buffers = BufferPool((BOARD_SIZE, BOARD_SIZE, 3))
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from typing import Any, Callable, List
+from routes.execution import inference_executor
+
+
+class MicroBatcher:
+    """Collects concurrent inference requests into one batched call.
+
+    The first request of a batch waits at most ``max_wait_ms`` for others to
+    join, or until ``max_batch_size`` requests are pending. ``predict`` gets the
+    list of items, runs on the inference thread pool and must return one result
+    per item.
+    """
+
+    def __init__(self, predict: Callable[[List[Any]], List[Any]], max_batch_size: int = 8, max_wait_ms: float = 5):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._has_items = None
+        self._is_full = None
+        self._runner = None
+
+    async def submit(self, item: Any) -> Any:
+        if self._runner is None or self._runner.done():
+            self._has_items = asyncio.Event()
+            self._is_full = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._is_full.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch_size:
+                try:
+                    await asyncio.wait_for(self._is_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            if len(self._pending) < self.max_batch_size:
+                self._is_full.clear()
+            if not self._pending:
+                self._has_items.clear()
+
+            # Callers that went away do not need a prediction
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(inference_executor, self.predict, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
@@ -0,0 +1,190 @@
+import contextlib
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+# Seconds, from a cached lookup up to a deep review
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        # Observes the time the block took, also when it raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for name, labels, (counts, total) in super().samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield name + "_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield name + "_count", labels, cumulative
+            yield name + "_sum", labels, total
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format.
+
+    Collectors are called on every scrape and return (name, kind, help, samples)
+    for values that already live elsewhere, such as the cache counters, so they
+    are not counted twice.
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func: Callable[[], Iterable]):
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        families = [(metric.name, metric.kind, metric.help, list(metric.samples())) for metric in self.metrics]
+        for collect in self.collectors:
+            try:
+                families.extend(collect())
+            except Exception as e:
+                print(f"Error collecting metrics from {collect.__name__}: {e}")
+
+        lines = []
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram("chess_stage_seconds", "Time spent in each stage of the FEN and review pipelines", ("pipeline", "stage")))
+engine_searches = registry.register(Counter("chess_engine_searches_total", "Engine searches run, cache hits excluded"))
+engine_search_nodes = registry.register(Counter("chess_engine_search_nodes_total", "Nodes searched by the engine"))
+engine_search_seconds = registry.register(Histogram("chess_engine_search_seconds", "Wall time of one engine search"))
+engine_checkout_seconds = registry.register(Histogram("chess_engine_checkout_seconds", "Time spent waiting for an engine from the pool"))
+http_requests_in_flight = registry.register(Gauge("http_requests_in_flight", "Requests being handled, by concurrency limited path", ("path",)))
+http_requests_rejected = registry.register(Counter("http_requests_rejected_total", "Requests answered with 503 by the concurrency limit", ("path",)))
+http_request_seconds = registry.register(Histogram("http_request_seconds", "Request latency until the response is fully sent", ("method", "route", "status")))
+
+
+def stage_timer(pipeline: str, stage: str):
+    return stage_seconds.time(pipeline=pipeline, stage=stage)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency of every HTTP request by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners cannot blow up the series count
+            route = getattr(route, "path", None) or "unmatched"
+            http_request_seconds.observe(time.perf_counter() - start, method=scope["method"], route=route, status=status)
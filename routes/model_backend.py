@@ -0,0 +1,175 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+
+
+# torch runs the .pt checkpoints directly, the others are exported next to them on first use
+BACKENDS = ("torch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+# Calibration dataset yaml for OpenVINO int8 export, ultralytics' default is used when unset
+OPENVINO_CALIBRATION_DATA = os.getenv("OPENVINO_CALIBRATION_DATA")
+
+
+def artifact_path(pt_path: str, backend: str) -> str:
+    base = os.path.splitext(pt_path)[0]
+    return {
+        "onnx": base + ".onnx",
+        "onnx-int8": base + ".int8.onnx",
+        "openvino": base + "_openvino_model",
+        "openvino-int8": base + "_int8_openvino_model",
+    }[backend]
+
+
+def _metadata_path(artifact: str) -> str:
+    return artifact.rstrip(os.sep) + ".backend.json"
+
+
+def export_model(pt_path: str, backend: str) -> str:
+    from ultralytics import YOLO
+
+    model = YOLO(pt_path)
+    target = artifact_path(pt_path, backend)
+    # dynamic axes so micro-batches of any size can be run
+    if backend == "onnx":
+        exported = model.export(format="onnx", dynamic=True)
+    elif backend == "onnx-int8":
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        exported = model.export(format="onnx", dynamic=True)
+        quantize_dynamic(exported, target, weight_type=QuantType.QInt8)
+        exported = target
+    elif backend == "openvino":
+        exported = model.export(format="openvino", dynamic=True)
+    elif backend == "openvino-int8":
+        options = {"data": OPENVINO_CALIBRATION_DATA} if OPENVINO_CALIBRATION_DATA else {}
+        exported = model.export(format="openvino", dynamic=True, int8=True, **options)
+    else:
+        raise ValueError(f"Unknown inference backend {backend}")
+
+    exported = str(exported).rstrip(os.sep)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        os.replace(exported, target)
+
+    # Exported models do not always carry the task, keep it next to the artifact
+    with open(_metadata_path(target), "w") as metadata:
+        json.dump({"task": model.task, "source_mtime": os.path.getmtime(pt_path)}, metadata)
+    return target
+
+
+def load_yolo(pt_path: str, backend: str = None):
+    # Loads the model with the configured backend, falling back to the torch checkpoint
+    from ultralytics import YOLO
+
+    backend = backend or INFERENCE_BACKEND
+    if backend != "torch":
+        try:
+            target = artifact_path(pt_path, backend)
+            metadata = None
+            if os.path.exists(_metadata_path(target)):
+                with open(_metadata_path(target)) as metadata_file:
+                    metadata = json.load(metadata_file)
+            if not os.path.exists(target) or metadata is None or metadata["source_mtime"] < os.path.getmtime(pt_path):
+                target = export_model(pt_path, backend)
+                with open(_metadata_path(target)) as metadata_file:
+                    metadata = json.load(metadata_file)
+            return YOLO(target, task=metadata["task"])
+        except Exception as e:
+            print(f"Error loading {backend} backend for {pt_path}, falling back to torch: {e}")
+    return YOLO(pt_path)
+
+
+class LazyModel:
+    """Loads a YOLO model on first use, at most once even when called from several threads."""
+
+    def __init__(self, pt_path: str, backend: str = None):
+        self.pt_path = pt_path
+        self.backend = backend
+        self.warm = False
+        self.error = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        self._model = load_yolo(self.pt_path, self.backend)
+                        self.error = None
+                    except Exception as e:
+                        self.error = str(e)
+                        raise
+        return self._model
+
+    def warmup(self, size=224):
+        # One pass on a blank image builds the lazily initialised runtime state
+        import numpy as np
+
+        self.get().predict(np.zeros((size, size, 3), dtype=np.uint8), verbose=False)
+        self.warm = True
+
+    def status(self):
+        return {"loaded": self.loaded, "warm": self.warm, "error": self.error}
+
+
+def image_to_fen(seg_model, detect_model, image_content, perspective="w", next_to_move="w"):
+    # The /getFen pipeline without batching, for comparing backends
+    import numpy as np
+    from routes.image_pipeline import decode_image, resize_into, BOARD_SIZE
+    from routes.segmentation import crop_to_board
+    from routes.detection import parse_detections
+    from routes.fen_generator import gen_fen
+
+    frame = decode_image(image_content)
+    board = crop_to_board(seg_model.predict(frame), frame)
+    if isinstance(board, dict):
+        return None
+    board = resize_into(board, np.empty((BOARD_SIZE, BOARD_SIZE, 3), dtype=np.uint8))
+    detections = parse_detections(detect_model.predict(board), detect_model.names)
+    if "error" in detections:
+        return None
+    return gen_fen(detections, perspective, next_to_move)
+
+
+def check_accuracy(backend: str, image_paths, min_agreement: float = 1.0) -> bool:
+    # Compares the FEN of every reference image against the torch backend
+    from routes.segmentation import seg_model_path
+    from routes.detection import detect_model_path
+
+    reference = (load_yolo(seg_model_path, "torch"), load_yolo(detect_model_path, "torch"))
+    candidate = (load_yolo(seg_model_path, backend), load_yolo(detect_model_path, backend))
+
+    matches = 0
+    for path in image_paths:
+        with open(path, "rb") as image_file:
+            image_content = image_file.read()
+        expected = image_to_fen(*reference, image_content)
+        actual = image_to_fen(*candidate, image_content)
+        matches += expected == actual
+        print(f"{'ok  ' if expected == actual else 'DIFF'} {path}\n     torch:   {expected}\n     {backend}: {actual}")
+
+    agreement = matches / len(image_paths) if image_paths else 0.0
+    print(f"{matches}/{len(image_paths)} FENs identical ({agreement:.1%})")
+    return agreement >= min_agreement
+
+
+if __name__ == "__main__":
+    # python -m routes.model_backend --backend onnx-int8 --images reference_images/
+    parser = argparse.ArgumentParser(description="Check a YOLO inference backend against torch on reference images")
+    parser.add_argument("--backend", choices=BACKENDS[1:], required=True)
+    parser.add_argument("--images", required=True, help="directory of board images or a single image")
+    parser.add_argument("--min-agreement", type=float, default=1.0, help="fraction of FENs that must match torch")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.images):
+        paths = sorted(p for ext in ("jpg", "jpeg", "png", "webp") for p in glob.glob(os.path.join(args.images, f"*.{ext}")))
+    else:
+        paths = [args.images]
+    sys.exit(0 if check_accuracy(args.backend, paths, args.min_agreement) else 1)
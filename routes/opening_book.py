@@ -0,0 +1,133 @@
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Optional, Tuple
+import numpy as np
+import chess
+import chess.polyglot
+
+
+# Index file layout: header, sorted uint64 Zobrist keys, uint32 opening ids, JSON list of [eco, name]
+INDEX_MAGIC = b"OBK1"
+HEADER = struct.Struct("<4sIII")
+
+
+class OpeningBook:
+    """Opening positions indexed by Zobrist hash, each mapped to its ECO code and name."""
+
+    def __init__(self, keys: np.ndarray, opening_ids: np.ndarray, openings: list):
+        self.keys = keys
+        self.opening_ids = opening_ids
+        self.openings = openings
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, board: chess.Board) -> Optional[Tuple[str, str]]:
+        if not len(self.keys):
+            return None
+        key = np.uint64(chess.polyglot.zobrist_hash(board))
+        index = np.searchsorted(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return tuple(self.openings[self.opening_ids[index]])
+        return None
+
+    @classmethod
+    def compile(cls, csv_path: str) -> "OpeningBook":
+        positions = {}
+        exact = set()
+        openings = []
+        with open(csv_path, newline='', encoding='utf-8') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader)
+            for row in reader:
+                if len(row) < 3:
+                    continue
+                opening_id = len(openings)
+                openings.append([row[0], row[1]])
+                board = chess.Board()
+                key = None
+                for move in row[2].split():
+                    if "." in move:
+                        continue
+                    try:
+                        board.push_san(move)
+                    except ValueError:
+                        break
+                    key = chess.polyglot.zobrist_hash(board)
+                    # Positions inside a line keep the first opening that passes through them
+                    positions.setdefault(key, opening_id)
+                if key is not None and key not in exact:
+                    # The position a line ends in is named after that line
+                    positions[key] = opening_id
+                    exact.add(key)
+
+        keys = np.fromiter(positions.keys(), dtype=np.uint64, count=len(positions))
+        opening_ids = np.fromiter(positions.values(), dtype=np.uint32, count=len(positions))
+        order = np.argsort(keys)
+        return cls(keys[order], opening_ids[order], openings)
+
+    def save(self, index_path: str):
+        names = json.dumps(self.openings, ensure_ascii=False).encode("utf-8")
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as index_file:
+            index_file.write(HEADER.pack(INDEX_MAGIC, len(self.keys), len(self.openings), len(names)))
+            index_file.write(self.keys.astype("<u8").tobytes())
+            index_file.write(self.opening_ids.astype("<u4").tobytes())
+            index_file.write(names)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path: str) -> "OpeningBook":
+        with open(index_path, "rb") as index_file:
+            data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_positions, _, names_size = HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not an opening book index")
+        offset = HEADER.size
+        # The key arrays are views on the mapping, no copy is made
+        keys = np.frombuffer(data, dtype="<u8", count=n_positions, offset=offset)
+        offset += keys.nbytes
+        opening_ids = np.frombuffer(data, dtype="<u4", count=n_positions, offset=offset)
+        offset += opening_ids.nbytes
+        openings = json.loads(bytes(data[offset:offset + names_size]).decode("utf-8"))
+        return cls(keys, opening_ids, openings)
+
+
+def default_index_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".bin"
+
+
+def load_opening_book(csv_path, index_path=None) -> OpeningBook:
+    # Compiles the CSV into a binary index the first time, later calls map the index
+    index_path = index_path or default_index_path(csv_path)
+    try:
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(csv_path):
+            book = OpeningBook.compile(csv_path)
+            try:
+                book.save(index_path)
+            except OSError as e:
+                # Read-only assets, the compiled book is used from memory and compiled again next start
+                print(f"Could not save the opening book index, using it from memory: {e}")
+                return book
+        return OpeningBook.load(index_path)
+    except Exception as e:
+        print(f"Error loading opening book: {e}")
+        return OpeningBook(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint32), [])
+
+
+def is_book_move(board, opening_book, max_depth=8):
+    if board.fullmove_number > max_depth:
+        return None
+    return opening_book.lookup(board)
+
+
+if __name__ == "__main__":
+    # python -m routes.opening_book [openings.csv] rebuilds the index
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), "assets", "openings_master.csv")
+    book = OpeningBook.compile(source)
+    book.save(default_index_path(source))
+    print(f"Indexed {len(book)} positions from {len(book.openings)} openings")
@@ -0,0 +1,97 @@
+import os
+import time
+from typing import Dict, List, Optional
+import chess
+import chess.engine
+from routes.engine_pool import engine_pool
+from routes.eval_cache import eval_cache
+from routes.execution import run_blocking_io
+from routes.metrics import stage_timer, engine_searches, engine_search_nodes, engine_search_seconds
+
+
+# Interactive searches: a short default depth, and every search stops after POSITION_MAX_TIME
+# seconds whatever depth or nodes were asked for
+POSITION_DEFAULT_DEPTH = int(os.getenv("POSITION_DEFAULT_DEPTH", "14"))
+POSITION_MAX_DEPTH = int(os.getenv("POSITION_MAX_DEPTH", "30"))
+POSITION_MAX_NODES = int(os.getenv("POSITION_MAX_NODES", "10000000"))
+POSITION_MAX_TIME = float(os.getenv("POSITION_MAX_TIME", "2.0"))
+POSITION_MAX_MULTIPV = int(os.getenv("POSITION_MAX_MULTIPV", "5"))
+# Waiting longer for an engine than for the search itself makes no sense for a single position
+POSITION_CHECKOUT_TIMEOUT = float(os.getenv("POSITION_CHECKOUT_TIMEOUT", "5"))
+
+
+def parse_position(fen: str) -> chess.Board:
+    # Raises ValueError for malformed FENs and for positions an engine cannot search
+    try:
+        board = chess.Board(fen.strip())
+    except ValueError as e:
+        raise ValueError(f"Invalid FEN: {e}") from None
+    status = board.status()
+    if status != chess.STATUS_VALID:
+        problems = [flag.name.lower() for flag in chess.Status if flag and flag & status]
+        raise ValueError(f"Illegal position: {', '.join(problems)}")
+    return board
+
+
+def search_limit(depth: Optional[int] = None, nodes: Optional[int] = None) -> chess.engine.Limit:
+    # The depth and node bounds of a search, the time cap is added by analyze_position
+    if depth is not None and not 1 <= depth <= POSITION_MAX_DEPTH:
+        raise ValueError(f"depth should be between 1 and {POSITION_MAX_DEPTH}")
+    if nodes is not None and not 1 <= nodes <= POSITION_MAX_NODES:
+        raise ValueError(f"nodes should be between 1 and {POSITION_MAX_NODES}")
+    if depth is None and nodes is None:
+        depth = POSITION_DEFAULT_DEPTH
+    return chess.engine.Limit(depth=depth, nodes=nodes)
+
+
+def format_line(board: chess.Board, info: Dict, rank: int) -> Dict:
+    score = info["score"].white()
+    pv = info.get("pv", [])
+    return {
+        "multipv": rank,
+        "best_move": pv[0].uci() if pv else None,
+        # From White's side, like the evaluations of a review
+        "evaluation": score.score() / 100 if not score.is_mate() else None,
+        "mate": score.mate(),
+        "pv": [move.uci() for move in pv],
+        "pv_san": board.variation_san(pv) if pv else "",
+        "depth": info.get("depth"),
+    }
+
+
+async def analyze_position(board: chess.Board, limit: chess.engine.Limit, multipv: int = 1) -> Dict:
+    if not 1 <= multipv <= POSITION_MAX_MULTIPV:
+        raise ValueError(f"multipv should be between 1 and {POSITION_MAX_MULTIPV}")
+    result = {"fen": board.fen(), "turn": "w" if board.turn == chess.WHITE else "b"}
+
+    outcome = board.outcome()
+    if outcome is not None:
+        # Nothing to search
+        return {**result, "game_over": outcome.termination.name.lower(), "result": outcome.result(), "lines": [], "cached": False}
+
+    # A single line may already be known from a review or an earlier request
+    if multipv == 1:
+        info = await run_blocking_io(eval_cache.get, board, limit)
+        if info is not None:
+            return {**result, "lines": [format_line(board, info, 1)], "nodes": info.get("nodes"), "time": 0.0, "cached": True}
+
+    started = time.perf_counter()
+    capped = chess.engine.Limit(depth=limit.depth, nodes=limit.nodes, time=POSITION_MAX_TIME)
+    with stage_timer("position", "engine"):
+        # Pooled engines keep their hash table between searches, so nearby positions come back faster
+        async with engine_pool.engine(timeout=POSITION_CHECKOUT_TIMEOUT) as engine:
+            with engine_search_seconds.time():
+                infos: List[Dict] = await engine.analyse(board, capped, multipv=multipv)
+    engine_searches.inc()
+    engine_search_nodes.inc(infos[0].get("nodes", 0))
+    if multipv == 1:
+        eval_cache.put(board, limit, infos[0])
+        await run_blocking_io(eval_cache.flush)
+
+    return {
+        **result,
+        "lines": [format_line(board, info, rank) for rank, info in enumerate(infos, start=1)],
+        "nodes": infos[0].get("nodes"),
+        "time": round(time.perf_counter() - started, 4),
+        "cached": False,
+    }
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, Optional, Tuple
+import chess
+import chess.pgn
+
+
+# Bump when the review output changes, older entries are then never served again
+REVIEW_CACHE_VERSION = 3
+# Bump when the stored engine evaluations change, see routes.classifier
+EVALUATION_VERSION = 1
+
+
+# Connections inherited over a fork, referenced so they are never closed (and finalized) in the child
+_inherited = []
+
+
+def normalized_mainline(game: chess.pgn.Game) -> str:
+    # Starting position and UCI mainline, headers, comments and variations do not change the review
+    return game.board().fen() + " | " + " ".join(move.uci() for move in game.mainline_moves())
+
+
+class ReviewCache:
+    """Finished reviews in an SQLite file, keyed by game, analysis profile and engine build.
+
+    Holds at most ``max_entries`` reviews and evicts the least recently used
+    ones. Entries are stored compressed; a hit costs one indexed read and no
+    engine or LLM time. The engine evaluations the reviews were classified
+    from are kept alongside, under the same bound, so a game can be
+    reclassified without searching it again.
+    """
+
+    def __init__(self, path: Optional[str], max_entries: int = 10_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = None
+        self.counters = {
+            "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0,
+            "evaluation_hits": 0, "evaluation_misses": 0, "evaluation_stores": 0, "evaluation_evictions": 0,
+        }
+
+        if path and max_entries > 0:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._connect()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Review cache disabled: {e}")
+                self._db = None
+
+    def _connect(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            "key TEXT PRIMARY KEY, game TEXT, profile TEXT, engine TEXT, "
+            "review BLOB, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS reviews_last_used ON reviews (last_used)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS reviews_game ON reviews (game)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS evaluations ("
+            "key TEXT PRIMARY KEY, game TEXT, profile TEXT, engine TEXT, "
+            "evaluation BLOB, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS evaluations_last_used ON evaluations (last_used)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS evaluations_game ON evaluations (game)")
+        self._db.commit()
+
+    def reopen(self):
+        # Same as EvalCache.reopen, a forked child needs its own connection
+        self._lock = threading.Lock()
+        if self._db is not None:
+            _inherited.append(self._db)
+            self._connect()
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    @staticmethod
+    def game_key(game: chess.pgn.Game) -> str:
+        return hashlib.sha256(normalized_mainline(game).encode()).hexdigest()
+
+    @staticmethod
+    def key(game_key: str, profile: str, engine: str, with_text_review: bool) -> str:
+        parts = (str(REVIEW_CACHE_VERSION), game_key, profile, engine, "text" if with_text_review else "engine")
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    @staticmethod
+    def evaluation_key(game_key: str, profile: str, engine: str) -> str:
+        # The same evaluation serves reviews with and without the text review
+        parts = (str(EVALUATION_VERSION), game_key, profile, engine)
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self._get("reviews", "review", key, "")
+
+    def put(self, key: str, game_key: str, profile: str, engine: str, review: Dict):
+        self._put("reviews", "review", key, game_key, profile, engine, review, "")
+
+    def get_evaluation(self, key: str) -> Optional[Dict]:
+        return self._get("evaluations", "evaluation", key, "evaluation_")
+
+    def put_evaluation(self, key: str, game_key: str, profile: str, engine: str, evaluation: Dict):
+        self._put("evaluations", "evaluation", key, game_key, profile, engine, evaluation, "evaluation_")
+
+    def evaluations(self, game_key: Optional[str] = None) -> Iterator[Tuple[str, str, Dict]]:
+        # (game key, profile, evaluation) of every stored evaluation, or those of one game
+        if self._db is None:
+            return
+        query = "SELECT game, profile, evaluation FROM evaluations"
+        with self._lock:
+            rows = self._db.execute(query + " WHERE game = ?", (game_key,)).fetchall() if game_key else self._db.execute(query).fetchall()
+        for game, profile, blob in rows:
+            yield game, profile, json.loads(zlib.decompress(blob))
+
+    def _get(self, table: str, column: str, key: str, counter: str) -> Optional[Dict]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(f"SELECT {column} FROM {table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters[counter + "misses"] += 1
+                return None
+            self._db.execute(f"UPDATE {table} SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.counters[counter + "hits"] += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def _put(self, table: str, column: str, key: str, game_key: str, profile: str, engine: str, value: Dict, counter: str):
+        if self._db is None:
+            return
+        blob = zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {table} (key, game, profile, engine, {column}, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, game_key, profile, engine, blob, len(blob), now, now),
+            )
+            excess = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute(f"DELETE FROM {table} WHERE key IN (SELECT key FROM {table} ORDER BY last_used LIMIT ?)", (excess,))
+                self.counters[counter + "evictions"] += excess
+            self._db.commit()
+            self.counters[counter + "stores"] += 1
+
+    def invalidate(self, game_key: Optional[str] = None) -> int:
+        # Drops every cached review and evaluation of one game, or the whole cache without a game_key
+        if self._db is None:
+            return 0
+        removed = 0
+        with self._lock:
+            for table in ("reviews", "evaluations"):
+                if game_key is None:
+                    removed += self._db.execute(f"DELETE FROM {table}").rowcount
+                else:
+                    removed += self._db.execute(f"DELETE FROM {table} WHERE game = ?", (game_key,)).rowcount
+            self._db.commit()
+            self.counters["invalidations"] += removed
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reviews").fetchone() if self._db is not None else (0, 0)
+            evaluations, evaluation_size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM evaluations").fetchone() if self._db is not None else (0, 0)
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "enabled": self.enabled,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "stored_bytes": size,
+                "evaluations": evaluations,
+                "evaluation_stored_bytes": evaluation_size,
+            }
+
+
+# REVIEW_CACHE_PATH set to an empty string, or REVIEW_CACHE_SIZE=0, disables the cache
+review_cache = ReviewCache(
+    os.getenv("REVIEW_CACHE_PATH", os.path.join(os.getcwd(), "cache", "review_cache.sqlite3")) or None,
+    max_entries=int(os.getenv("REVIEW_CACHE_SIZE", "10000")),
+)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=review_cache.reopen)
@@ -0,0 +1,270 @@
+import asyncio
+import contextlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from typing import AsyncIterator, Dict, Optional
+import chess.pgn
+from routes.chess_review import collect_review, DEFAULT_PROFILE
+from routes.engine_pool import EnginePoolTimeout
+from routes.execution import run_blocking_io
+
+
+REVIEW_JOB_WORKERS = int(os.getenv("REVIEW_JOB_WORKERS", "2"))
+REVIEW_JOB_QUEUE_SIZE = int(os.getenv("REVIEW_JOB_QUEUE_SIZE", "8"))
+REVIEW_JOB_TTL = float(os.getenv("REVIEW_JOB_TTL", "3600"))
+# Shared by all server workers, any of them can answer for a job another one runs
+REVIEW_JOB_DIR = os.getenv("REVIEW_JOB_DIR", os.path.join(tempfile.gettempdir(), "review_jobs"))
+
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class ReviewJob:
+    """A multi-game PGN under review, kept in its own directory of the jobs directory.
+
+    Results are appended to a JSONL file and the summary is rewritten to
+    job.json on every change, so workers that do not run the job can report on it.
+    """
+
+    def __init__(self, profile: str, root: str, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.profile = profile
+        self.directory = os.path.join(root, self.id)
+        self.pgn_path = os.path.join(self.directory, "games.pgn")
+        self.results_path = os.path.join(self.directory, "results.jsonl")
+        self.state_path = os.path.join(self.directory, "job.json")
+        self.status = "queued"
+        self.error = None
+        self.games_read = 0
+        self.games_done = 0
+        self.games_failed = 0
+        self.finished_reading = False
+        self.created_at = time.time()
+        self.finished_at = None
+        self.reader = None
+        self.changed = asyncio.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def summary(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "profile": self.profile,
+            "games_read": self.games_read,
+            "games_done": self.games_done,
+            "games_failed": self.games_failed,
+            "finished_reading": self.finished_reading,
+            "error": self.error,
+        }
+
+    def save(self):
+        state = {**self.summary(), "created_at": self.created_at, "finished_at": self.finished_at}
+        # Gone when the job was removed, possibly by another worker
+        with contextlib.suppress(FileNotFoundError):
+            with open(self.state_path + ".tmp", "w") as state_file:
+                json.dump(state, state_file)
+            os.replace(self.state_path + ".tmp", self.state_path)
+
+    @classmethod
+    def load(cls, root: str, job_id: str) -> Optional["ReviewJob"]:
+        # A snapshot of a job run by another worker
+        try:
+            with open(os.path.join(root, job_id, "job.json")) as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        job = cls(state["profile"], root, job_id)
+        for name in ("status", "error", "games_read", "games_done", "games_failed", "finished_reading", "created_at", "finished_at"):
+            setattr(job, name, state[name])
+        return job
+
+    @property
+    def removed(self):
+        return not os.path.isdir(self.directory)
+
+    async def notify(self):
+        self.save()
+        async with self.changed:
+            self.changed.notify_all()
+
+
+class ReviewJobManager:
+    """Feeds games of submitted jobs through a bounded queue to a fixed set of review workers.
+
+    A job is run by the server worker that accepted it. Other workers find it
+    in the jobs directory, and removing it there makes its worker stop.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 8, ttl: float = 3600, root: str = REVIEW_JOB_DIR):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.root = root
+        # The jobs this worker runs
+        self.jobs: Dict[str, ReviewJob] = {}
+        self._queue = None
+        self._tasks = []
+
+    def _start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._expire()))
+
+    async def submit(self, pgn_data: bytes, profile: str = DEFAULT_PROFILE) -> ReviewJob:
+        self._start()
+        job = ReviewJob(profile, self.root)
+        os.makedirs(job.directory)
+        with open(job.pgn_path, "wb") as pgn_file:
+            pgn_file.write(pgn_data)
+        job.save()
+        self.jobs[job.id] = job
+        job.reader = asyncio.create_task(self._read_games(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[ReviewJob]:
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        return ReviewJob.load(self.root, job_id)
+
+    async def _read_games(self, job: ReviewJob):
+        # Games are parsed one at a time, the bounded queue keeps the rest of the file on disk. Parsing runs
+        # in the I/O threads, a huge game would otherwise hold up every request of this worker.
+        try:
+            with open(job.pgn_path, encoding="utf-8", errors="replace") as pgn:
+                while not job.removed:
+                    game = await run_blocking_io(chess.pgn.read_game, pgn)
+                    if game is None:
+                        break
+                    await self._queue.put((job, job.games_read, game))
+                    job.games_read += 1
+            job.finished_reading = True
+            if job.status == "queued":
+                job.status = "running"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = time.time()
+        await self._check_finished(job)
+
+    async def _worker(self):
+        while True:
+            job, index, game = await self._queue.get()
+            try:
+                if job.finished:
+                    continue
+                if job.removed:
+                    # Deleted through another worker
+                    await self.remove(job.id)
+                    continue
+                if job.status != "running":
+                    job.status = "running"
+                    await job.notify()
+                line = await self._review(job, index, game)
+                if job.finished or job.removed:
+                    # Cancelled while this game was under review
+                    continue
+                with contextlib.suppress(FileNotFoundError), open(job.results_path, "a", encoding="utf-8") as results:
+                    results.write(json.dumps(line) + "\n")
+                await self._check_finished(job)
+            finally:
+                self._queue.task_done()
+
+    async def _review(self, job: ReviewJob, index: int, game: chess.pgn.Game) -> Dict:
+        while True:
+            try:
+                # One engine per game, the job workers provide the parallelism
+                review = await collect_review(game, None, job.profile, parallelism=1)
+                job.games_done += 1
+                return {"game_index": index, "headers": dict(game.headers), "review": review}
+            except EnginePoolTimeout:
+                # Interactive requests have the pool, wait for our turn
+                continue
+            except Exception as e:
+                job.games_failed += 1
+                return {"game_index": index, "headers": dict(game.headers), "error": str(e)}
+
+    async def _check_finished(self, job: ReviewJob):
+        if not job.finished and job.finished_reading and job.games_done + job.games_failed == job.games_read:
+            job.status = "done"
+            job.finished_at = time.time()
+        await job.notify()
+
+    async def stream_results(self, job: ReviewJob) -> AsyncIterator[str]:
+        # Yields result lines as they are written until the job is finished
+        position = 0
+        local = job.id in self.jobs
+        while True:
+            if local:
+                async with job.changed:
+                    if not job.finished:
+                        with contextlib.suppress(asyncio.TimeoutError):
+                            await asyncio.wait_for(job.changed.wait(), 1.0)
+                finished = job.finished
+            else:
+                # Run by another worker, its state file is polled
+                if not job.finished:
+                    await asyncio.sleep(1.0)
+                snapshot = ReviewJob.load(self.root, job.id)
+                finished = snapshot is None or snapshot.finished
+            # The directory disappears when the job is removed
+            with contextlib.suppress(FileNotFoundError), open(job.results_path, "rb") as results:
+                results.seek(position)
+                while True:
+                    line = results.readline()
+                    if not line.endswith(b"\n"):
+                        break
+                    position += len(line)
+                    yield line.decode("utf-8")
+            if finished:
+                return
+
+    async def remove(self, job_id: str):
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            # Run by another worker, which stops once the directory is gone
+            if JOB_ID.fullmatch(job_id):
+                shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+            return
+        if not job.finished:
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        if job.reader is not None:
+            job.reader.cancel()
+        await job.notify()
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    async def _expire(self):
+        while True:
+            await asyncio.sleep(min(self.ttl, 60))
+            now = time.time()
+            for job in list(self.jobs.values()):
+                if job.finished and now - job.finished_at > self.ttl:
+                    await self.remove(job.id)
+            # Left behind by workers that exited, their state has not changed for a whole TTL
+            for job_id in os.listdir(self.root) if os.path.isdir(self.root) else []:
+                if job_id not in self.jobs and JOB_ID.fullmatch(job_id):
+                    with contextlib.suppress(FileNotFoundError):
+                        if now - os.path.getmtime(os.path.join(self.root, job_id)) > self.ttl:
+                            shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for job_id in list(self.jobs):
+            await self.remove(job_id)
+
+
+review_jobs = ReviewJobManager(REVIEW_JOB_WORKERS, REVIEW_JOB_QUEUE_SIZE, REVIEW_JOB_TTL)
@@ -1,27 +1,44 @@
-from ultralytics import YOLO
-from PIL import Image
+import numpy as np
 import os
+from routes.inference_batcher import MicroBatcher, INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT_MS
+from routes.model_backend import LazyModel
+from routes.image_pipeline import crop_view
 
 curr = os.getcwd()
 seg_model_path = os.path.join(curr, 'models', 'SegModel (1).pt')
 
-seg_model = YOLO(seg_model_path)
-
-async def segment_chess_board(image : Image):
-    if image is None:
-        return {"error" : "No image found" }    
-    
-    results = seg_model.predict(image)
+# Loaded on the first prediction, or at startup when PRELOAD_MODELS is set
+seg_model = LazyModel(seg_model_path)
+# Concurrent requests share one batched predict call
+seg_batcher = MicroBatcher(lambda images: seg_model.get().predict(images), INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT_MS)
 
+def board_bbox(results):
+    # (x_min, y_min, x_max, y_max) of the board in the segmented frame
     if not results or len(results) == 0:
         return {"error" : "No chessboard detected"}
 
     if len(results) > 1:
         return {"error" : "Multiple  chess boards found in the image"}
-    
+
+    if len(results[0].boxes.xyxy) == 0:
+        return {"error" : "No chessboard detected"}
+
     xywh = results[0].boxes.xyxy[0].tolist()
-    x_min, y_min, x_max, y_max = map(int, xywh)
+    return tuple(map(int, xywh))
+
+def crop_to_board(results, image : np.ndarray):
+    bbox = board_bbox(results)
+    if isinstance(bbox, dict):
+        return bbox
+
+    segmented_image = crop_view(image, *bbox)
+
+    return segmented_image
+
+async def segment_chess_board(image : np.ndarray):
+    if image is None:
+        return {"error" : "No image found" }    
     
-    segmented_image = image.crop((x_min, y_min, x_max, y_max)) 
+    results = [await seg_batcher.submit(image)]
 
-    return segmented_image
\ No newline at end of file
+    return crop_to_board(results, image)
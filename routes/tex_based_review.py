@@ -1,20 +1,22 @@
+import asyncio
 import os
 import json
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq
 import re
+from routes.metrics import stage_timer
 
-def review_chess_game(pgn_file_path):
-    # Load environment variables and initialize Groq client
-    load_dotenv()
-    API_KEY = os.getenv("GROQ_API_KEY")
-    
-    if not API_KEY:
-        raise ValueError("API key not found. Please set GROQ_API_KEY in the .env file.")
-    client = Groq(api_key=API_KEY)
+# Read once at import instead of on every review
+load_dotenv()
+
+TEXT_REVIEW_MODEL = os.getenv("TEXT_REVIEW_MODEL", "llama-3.3-70b-versatile")
+# The engine review is never held back longer than this by the text review
+TEXT_REVIEW_TIMEOUT = float(os.getenv("TEXT_REVIEW_TIMEOUT", "20"))
+TEXT_REVIEW_MAX_CONNECTIONS = int(os.getenv("TEXT_REVIEW_MAX_CONNECTIONS", "16"))
+TEXT_REVIEW_MAX_RETRIES = int(os.getenv("TEXT_REVIEW_MAX_RETRIES", "1"))
 
-    # JSON structured prompt
-    template = (
+TEMPLATE = (
     "You are tasked with reviewing a chess game in PGN format: {pgn_content}. "
     "Please provide the analysis in JSON format with the following structure:\n"
     "{{\n"
@@ -35,21 +37,68 @@ def review_chess_game(pgn_file_path):
     "Make sure the JSON is well-formatted and does not contain any invalid content."
 )
 
-    # Read PGN content
+
+_client = None
+
+
+def get_client() -> AsyncGroq:
+    # One client for the whole process so connections to the API are kept alive and reused.
+    # GROQ_BASE_URL points it at a local stub for tests and benchmarks.
+    global _client
+    if _client is None:
+        API_KEY = os.getenv("GROQ_API_KEY")
+        if not API_KEY:
+            raise ValueError("API key not found. Please set GROQ_API_KEY in the .env file.")
+        _client = AsyncGroq(
+            api_key=API_KEY,
+            base_url=os.getenv("GROQ_BASE_URL") or None,
+            max_retries=TEXT_REVIEW_MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=TEXT_REVIEW_MAX_CONNECTIONS, max_keepalive_connections=TEXT_REVIEW_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(TEXT_REVIEW_TIMEOUT, connect=5.0),
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def parse_review(response_text: str):
+    response_text = response_text.strip()
+
+    # Remove unnecessary text before JSON starts
+    response_text = re.sub(r"(?s)^.*?\{", "{", response_text).strip()
+    response_text = re.sub(r"```json|```", "", response_text).strip()
+
+    # Ensure the response is valid JSON
     try:
-        with open(pgn_file_path, 'r') as file:
-            pgn_content = file.read()
-    except FileNotFoundError:
-        return {"error": f"File '{pgn_file_path}' not found."}
+        structured_data = json.loads(response_text)
+        return structured_data
+    except json.JSONDecodeError as e:
+        return {"error": f"Failed to parse JSON: {str(e)}", "raw_response": response_text}
+
 
-    # Format the prompt
-    prompt = template.format(pgn_content=pgn_content)
+async def review_chess_game(source):
+    # PGN text, or the path of a PGN file as before, like the other review entry points
+    from routes.chess_review import is_pgn_path, read_text
+    from routes.execution import run_blocking_io
+
+    try:
+        pgn_content = await run_blocking_io(read_text, source) if is_pgn_path(source) else source
+    except OSError as e:
+        return {"error": f"Error reading PGN file: {str(e)}"}
 
     # Interact with Groq API
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
+        client = get_client()
+        completion = await client.chat.completions.create(
+            model=TEXT_REVIEW_MODEL,
+            messages=[{"role": "user", "content": TEMPLATE.format(pgn_content=pgn_content)}],
             temperature=1,
             max_tokens=4096,
             top_p=1,
@@ -58,26 +107,22 @@ def review_chess_game(pgn_file_path):
         )
 
         response_text = ""
-        for message in completion:
+        async for message in completion:
             if message.choices and message.choices[0].delta.content:
                 response_text += message.choices[0].delta.content
-        response_text = response_text.strip()
+        return parse_review(response_text)
 
-        # Remove unnecessary text before JSON starts
-        response_text = re.sub(r"(?s)^.*?\{", "{", response_text).strip()
-        response_text = re.sub(r"```json|```", "", response_text).strip()
+    except Exception as e:
+        return {"error": f"Error processing PGN: {str(e)}"}
 
 
-        # Ensure the response is valid JSON
+async def text_review(pgn_content: str, timeout: float = TEXT_REVIEW_TIMEOUT):
+    # Never raises: a slow or failing API degrades to an error entry in the review
+    with stage_timer("review", "text_review"):
         try:
-            structured_data = json.loads(response_text)
-            return structured_data
-        except json.JSONDecodeError as e:
-            return {"error": f"Failed to parse JSON: {str(e)}", "raw_response": response_text}
-
-
-    except Exception as e:
-        return {"error": f"Error processing PGN: {str(e)}"}
+            return await asyncio.wait_for(review_chess_game(pgn_content), timeout)
+        except asyncio.TimeoutError:
+            return {"error": f"Text review timed out after {timeout:g}s"}
 
 def validate_json(review):
     """Check if the input is a valid JSON string or dictionary."""
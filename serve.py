@@ -0,0 +1,205 @@
+"""Multi-worker server that loads everything once and forks.
+
+The parent process imports the app, loads and warms the YOLO models and maps
+the opening book, then forks WEB_WORKERS uvicorn workers that accept on one
+shared socket. The workers share the model weights, the torch runtime and the
+book index copy-on-write instead of loading their own copies:
+
+    WEB_WORKERS=4 TORCH_THREADS=2 ENGINE_POOL_SIZE=2 python serve.py
+
+A worker that dies is forked again from the parent, which has everything
+loaded already. SIGTERM or Ctrl-C stops the workers gracefully. The engine
+pool, the inference threads, the FEN cache and /metrics are per worker, the
+SQLite caches are shared through their files. A review job runs on the worker
+that accepted it, the others answer for it from REVIEW_JOB_DIR, which all
+workers must share. Jobs of a worker that dies are not resumed, they are
+removed once REVIEW_JOB_TTL has passed. Memory per process is printed by
+
+    python serve.py --memory <pid of the parent>
+
+PSS is the number to compare, RSS counts the shared model pages once per worker.
+
+Linux and macOS only, on Windows run uvicorn main:app as before.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "2"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "7860"))
+# Threads torch may use for one inference in each worker, by default the cores are split between workers
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))
+# A worker forked within this many seconds of the last one dying waits before being forked again
+RESTART_BACKOFF = float(os.getenv("WORKER_RESTART_BACKOFF", "1.0"))
+
+
+def configure_workers(workers: int, torch_threads: int):
+    # Per-worker sizes, read by the routes modules at import, so this runs before main is imported
+    cores = os.cpu_count() or 1
+    torch_threads = torch_threads or max(1, cores // workers)
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(name, str(torch_threads))
+    os.environ.setdefault("INFERENCE_THREADS", str(max(2, cores // workers)))
+    os.environ.setdefault("ENGINE_POOL_SIZE", str(max(1, cores // workers)))
+    return torch_threads
+
+
+def preload():
+    # Everything loaded here is shared by the workers, nothing here may start threads or event loops
+    import main
+
+    if main.ENABLE_FEN:
+        for model in (main.seg_model, main.detect_model):
+            try:
+                model.get()
+                # The first prediction fuses layers and builds the predictor, done once here so the
+                # workers do not each write to (and so copy) the weights. One thread, so OpenMP
+                # starts no thread pool that the forked workers would inherit broken.
+                if "torch" in sys.modules:
+                    sys.modules["torch"].set_num_threads(1)
+                if main.WARMUP_MODELS:
+                    model.warmup()
+            except Exception as e:
+                print(f"Error preloading {model.pt_path}: {e}")
+    # Objects that exist now are never collected, so the collector does not write to their pages
+    gc.collect()
+    gc.freeze()
+    return main.app
+
+
+def run_worker(app, sock: socket.socket, torch_threads: int):
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(torch_threads)
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="on", log_level=os.getenv("LOG_LEVEL", "info")))
+    server.run(sockets=[sock])
+
+
+def serve(workers: int, host: str, port: int, torch_threads: int):
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork, run uvicorn main:app instead")
+    torch_threads = configure_workers(workers, torch_threads)
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+    app = preload()
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, sock, torch_threads)
+            finally:
+                os._exit(0)
+        children[pid] = time.monotonic()
+        print(f"Started worker {pid}", flush=True)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving on http://{host}:{port} with {workers} workers, {torch_threads} torch threads and "
+          f"{os.environ['ENGINE_POOL_SIZE']} engines each (parent {os.getpid()})", flush=True)
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None:
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}", flush=True)
+        if not stopping:
+            if time.monotonic() - started < RESTART_BACKOFF:
+                time.sleep(RESTART_BACKOFF)
+            spawn()
+    sock.close()
+
+
+def _smaps_rollup(pid: int):
+    # kB values of /proc/<pid>/smaps_rollup, Linux 4.14 and later
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as rollup:
+        for line in rollup:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return values
+
+
+def _children(pid: int):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as listing:
+            children.extend(int(child) for child in listing.read().split())
+    return children
+
+
+def _name(pid: int) -> str:
+    with open(f"/proc/{pid}/cmdline", "rb") as cmdline:
+        args = [os.path.basename(arg.decode(errors="replace")) for arg in cmdline.read().split(b"\0") if arg]
+    return " ".join(args[:3])
+
+
+def memory_report(pid: int):
+    # RSS counts shared pages in full for every process, PSS splits them between the processes
+    # sharing them and USS (private) is what a process frees on exit. PSS adds up to the real total.
+    print(f"{'pid':>8} {'rss MiB':>9} {'pss MiB':>9} {'uss MiB':>9} {'shared MiB':>11}  process")
+    total_pss = 0
+
+    def report(pid, depth):
+        nonlocal total_pss
+        try:
+            memory = _smaps_rollup(pid)
+        except (FileNotFoundError, PermissionError):
+            return
+        uss = memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0)
+        shared = memory.get("Shared_Clean", 0) + memory.get("Shared_Dirty", 0)
+        total_pss += memory.get("Pss", 0)
+        print(f"{pid:>8} {memory.get('Rss', 0) / 1024:>9.1f} {memory.get('Pss', 0) / 1024:>9.1f} {uss / 1024:>9.1f} {shared / 1024:>11.1f}  {'  ' * depth}{_name(pid)}")
+        for child in _children(pid):
+            report(child, depth + 1)
+
+    report(pid, 0)
+    print(f"{'total':>8} {'':>9} {total_pss / 1024:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--torch-threads", type=int, default=TORCH_THREADS, help="torch threads per worker, 0 splits the cores")
+    parser.add_argument("--memory", type=int, metavar="PID", help="print the memory of a running server and its workers and exit")
+    args = parser.parse_args()
+
+    if args.memory:
+        memory_report(args.memory)
+    else:
+        serve(args.workers, args.host, args.port, args.torch_threads)
+
+
+if __name__ == "__main__":
+    main()